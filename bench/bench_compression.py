@@ -0,0 +1,255 @@
+"""Measure the bytes and latency of a scripted session, per response encoding.
+
+Run from the root of the repository:
+
+    python -m bench.bench_compression
+    python -m bench.bench_compression --repeat 5
+
+gunicorn serves the app with the settings of gunicorn.conf.py. The session
+loads the page (index, layout, dependencies, scripts and assets), then moves
+the sliders and the statistic of both tabs, sending each query callback and
+the chart callbacks that take its result, as the browser would, and finally
+comes back to selections it has already seen.
+
+The session is replayed by a client that accepts no compression, gzip, or
+brotli, and by a brotli client that reloads the page after a first visit,
+sending If-None-Match with the ETag of its last response to the same GET
+request, and If-Modified-Since for the assets, like a browser. Callbacks are
+POST requests, which are not revalidated. The chart cache is warmed up by a
+first run, so the latencies compare the sending of the responses, not the
+queries.
+"""
+
+import argparse
+import gzip
+import http.client
+import json
+import re
+import statistics
+import subprocess
+import sys
+import time
+import zlib
+
+import brotli
+
+from bench.bench_workers import free_port, wait_until_ready
+
+CALLBACK = "/_dash-update-component"
+
+## Widget changes of the session, as (tab, widget, value), applied in turn
+STEPS = [
+    ("trend", "year_range_widget_trend", [1995, 2010]),
+    ("trend", "year_range_widget_trend", [1995, 2015]),
+    ("trend", "stat_type_widget_trend", "raw_stats"),
+    ("trend", "year_range_widget_trend", [2000, 2015]),
+    ("snapshot", "year_widget_snapshot", 2010),
+    ("snapshot", "year_widget_snapshot", 2005),
+    ("snapshot", "stat_type_widget_snapshot", "raw_stats"),
+    ("snapshot", "year_widget_snapshot", 2010),
+    ## Back to selections seen before
+    ("trend", "stat_type_widget_trend", "pc_k"),
+    ("trend", "year_range_widget_trend", [1995, 2010]),
+    ("snapshot", "stat_type_widget_snapshot", "pc_k"),
+    ("snapshot", "year_widget_snapshot", 2005),
+]
+
+## Name: (Accept-Encoding, revalidates, sessions before the measured one)
+CLIENTS = {
+    "identity": ("identity", False, 0),
+    "gzip": ("gzip, deflate", False, 0),
+    "br": ("gzip, deflate, br", False, 0),
+    "br, reload": ("gzip, deflate, br", True, 1),
+}
+
+
+class Client:
+    """Send requests to the server and record the bytes and time of each."""
+
+    def __init__(self, port, accept_encoding, revalidate):
+        self.port = port
+        self.headers = {"Accept-Encoding": accept_encoding}
+        self.revalidate = revalidate
+        self.validators = {}
+        self.bodies = {}
+        self.log = []
+
+    def request(self, kind, method, path, payload=None):
+        body = json.dumps(payload) if payload is not None else None
+        key = (method, path, body)
+        headers = dict(self.headers)
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        if self.revalidate and method == "GET" and key in self.validators:
+            headers.update(self.validators[key])
+
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        start = time.perf_counter()
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        data = response.read()
+        seconds = time.perf_counter() - start
+        connection.close()
+
+        ## Bytes of the body on the wire
+        self.log.append((kind, response.status, len(data), seconds))
+        if response.status == 304:
+            data = self.bodies[key]
+        elif response.status == 200:
+            if response.getheader("Content-Encoding"):
+                ## Decoding is not timed: browsers do it off the main thread
+                data = decode(data, response.getheader("Content-Encoding"))
+            self.bodies[key] = data
+            validators = {}
+            if response.getheader("ETag"):
+                validators["If-None-Match"] = response.getheader("ETag")
+            if response.getheader("Last-Modified"):
+                validators["If-Modified-Since"] = response.getheader("Last-Modified")
+            self.validators[key] = validators
+        else:
+            raise RuntimeError(f"{method} {path} returned {response.status}")
+        return data
+
+
+def decode(data, encoding):
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "deflate":
+        return zlib.decompress(data)
+    if encoding == "br":
+        return brotli.decompress(data)
+    raise ValueError(f"unknown encoding {encoding}")
+
+
+def walk(component, values):
+    """The properties of each component of the layout, by id."""
+    if isinstance(component, dict):
+        props = component.get("props", {})
+        if "id" in props:
+            values[props["id"]] = props
+        walk(props.get("children"), values)
+    elif isinstance(component, list):
+        for child in component:
+            walk(child, values)
+    return values
+
+
+def load_page(client):
+    index = client.request("page", "GET", "/").decode()
+    layout = json.loads(client.request("page", "GET", "/_dash-layout"))
+    dependencies = json.loads(client.request("page", "GET", "/_dash-dependencies"))
+    for path in re.findall(r'(?:src|href)="(/[^"]+)"', index):
+        client.request("page", "GET", path)
+    return walk(layout, {}), dependencies
+
+
+def callback(client, dependency, values):
+    """Send a server callback with the current values, and store its output."""
+
+    def props(items):
+        return [
+            {**item, "value": values[item["id"]].get(item["property"])}
+            for item in items
+        ]
+
+    output_id, output_property = dependency["output"].split(".")
+    payload = {
+        "output": dependency["output"],
+        "outputs": {"id": output_id, "property": output_property},
+        "inputs": props(dependency["inputs"]),
+        "changedPropIds": [f"{i['id']}.{i['property']}" for i in dependency["inputs"]],
+        "state": props(dependency["state"]),
+    }
+    response = json.loads(client.request("callback", "POST", CALLBACK, payload))
+    values.setdefault(output_id, {})[output_property] = response["response"][output_id][
+        output_property
+    ]
+
+
+def session(client):
+    values, dependencies = load_page(client)
+    server_callbacks = [d for d in dependencies if not d.get("clientside_function")]
+
+    def update(tab):
+        query = next(d for d in server_callbacks if d["output"] == f"{tab}_query.data")
+        callback(client, query, values)
+        for dependency in server_callbacks:
+            if any(i["id"] == f"{tab}_query" for i in dependency["inputs"]):
+                callback(client, dependency, values)
+
+    update("trend")
+    update("snapshot")
+    for tab, widget, value in STEPS:
+        values[widget]["value"] = value
+        update(tab)
+
+
+def summary(log, kind):
+    entries = [entry for entry in log if kind in (None, entry[0])]
+    latencies = [seconds for _, _, _, seconds in entries]
+    return {
+        "requests": len(entries),
+        "304": sum(status == 304 for _, status, _, _ in entries),
+        "kB": sum(nbytes for _, _, nbytes, _ in entries) / 1000,
+        "median ms": 1000 * statistics.median(latencies),
+        "total ms": 1000 * sum(latencies),
+    }
+
+
+def main(args):
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--config",
+            "gunicorn.conf.py",
+            "--workers",
+            "1",
+            "--bind",
+            f"127.0.0.1:{port}",
+            "src.app:server",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(f"http://127.0.0.1:{port}", process, args.timeout)
+        session(Client(port, "identity", revalidate=False))
+
+        print(
+            f"{'client':<16} {'requests':<9} {'count':>6} {'304':>5} "
+            f"{'kB':>9} {'median ms':>10} {'total ms':>9}"
+        )
+        for name, (accept_encoding, revalidate, visits) in CLIENTS.items():
+            logs = []
+            for _ in range(args.repeat):
+                client = Client(port, accept_encoding, revalidate)
+                for _ in range(visits):
+                    session(client)
+                client.log = []
+                session(client)
+                logs.append(client.log)
+            ## The run with the smallest total time
+            log = min(logs, key=lambda log: sum(entry[3] for entry in log))
+            for kind in ["page", "callback", None]:
+                s = summary(log, kind)
+                print(
+                    f"{name:<16} {kind or 'all':<9} {s['requests']:>6} {s['304']:>5} "
+                    f"{s['kB']:>9.1f} {s['median ms']:>10.2f} {s['total ms']:>9.1f}"
+                )
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the bytes and latency of a scripted session."
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per client")
+    parser.add_argument(
+        "--timeout", type=int, default=120, help="seconds to wait for gunicorn"
+    )
+    main(parser.parse_args())
@@ -0,0 +1,142 @@
+"""Compare cube queries with the pandas filtering path the callbacks used to take.
+
+Run from the root of the repository:
+
+    python -m bench.bench_cube
+"""
+
+import timeit
+
+import pandas as pd
+
+from src import dataset
+from src.app import country_list, default_country_list, disease_list
+
+NUMBER = 200
+
+SELECTIONS = {
+    "typical": dict(year=2015, year_range=(2000, 2010), countries=default_country_list),
+    "worst case": dict(year=2015, year_range=(1990, 2015), countries=country_list),
+}
+
+
+## The pandas path: boolean masks over the long table, then a groupby
+def select(first_year, last_year, countries, diseases):
+    df = dataset.disease_count_data
+    return df[
+        (df["year"] >= first_year)
+        & (df["year"] <= last_year)
+        & (df["country"].isin(countries))
+        & (df["disease"].isin(diseases))
+    ]
+
+
+def per_capita(df):
+    return df.assign(count_pkc=1000 * df["count"] / df["ncu5"])
+
+
+def pandas_by_country(year, countries, diseases):
+    return (
+        per_capita(select(year, year, countries, diseases))
+        .groupby(by="country", observed=True)
+        .sum(numeric_only=True)
+        .reset_index()
+    )
+
+
+def pandas_by_disease(year, countries, diseases):
+    return (
+        per_capita(select(year, year, countries, diseases))
+        .groupby(by="disease", observed=True)
+        .sum(numeric_only=True)
+        .reset_index()
+    )
+
+
+def pandas_trend_rows(year_range, countries, diseases):
+    return per_capita(select(year_range[0], year_range[1], countries, diseases))
+
+
+def pandas_map_rows(year, countries, diseases):
+    country_count = pandas_by_country(year, countries, diseases)
+    return pd.merge(
+        country_count,
+        dataset.country_data[["country", "iso_alpha"]],
+        on="country",
+        how="left",
+    )
+
+
+def cube_by_country(year, countries, diseases):
+    return dataset.totals_by_country(year, countries, diseases, per_capita=True)
+
+
+def cube_by_disease(year, countries, diseases):
+    return dataset.totals_by_disease(year, countries, diseases, per_capita=True)
+
+
+def cube_map_rows(year, countries, diseases):
+    return dataset.with_country_attributes(
+        cube_by_country(year, countries, diseases), ["iso_alpha"]
+    )
+
+
+def cube_trend_rows(year_range, countries, diseases):
+    return dataset.trend_rows(*year_range, countries, diseases, per_capita=True)
+
+
+def cube_slice_only(year_range, countries, diseases):
+    return dataset.cube_slice(*year_range, countries, diseases, per_capita=True)
+
+
+def best_of(func, *args):
+    return min(timeit.repeat(lambda: func(*args), number=NUMBER, repeat=3)) / NUMBER
+
+
+def main():
+    print(f"{'selection':<11} {'query':<22} {'pandas (ms)':>12} {'cube (ms)':>10}")
+    for name, selection in SELECTIONS.items():
+        year = selection["year"]
+        year_range = selection["year_range"]
+        countries = selection["countries"]
+        cases = [
+            (
+                "snapshot by country",
+                pandas_by_country,
+                cube_by_country,
+                (year, countries, disease_list),
+            ),
+            (
+                "snapshot by disease",
+                pandas_by_disease,
+                cube_by_disease,
+                (year, countries, disease_list),
+            ),
+            (
+                "map rows",
+                pandas_map_rows,
+                cube_map_rows,
+                (year, countries, disease_list),
+            ),
+            (
+                "trend rows",
+                pandas_trend_rows,
+                cube_trend_rows,
+                (year_range, countries, disease_list),
+            ),
+            (
+                "trend slice (ndarray)",
+                pandas_trend_rows,
+                cube_slice_only,
+                (year_range, countries, disease_list),
+            ),
+        ]
+        for query, pandas_func, cube_func, args in cases:
+            print(
+                f"{name:<11} {query:<22} {1000 * best_of(pandas_func, *args):>12.3f} "
+                f"{1000 * best_of(cube_func, *args):>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Compare the per-variable merge loop with the single-pass indexed join.
+
+Run from the root of the repository:
+
+    python -m bench.bench_merge
+
+Synthetic indicator files shaped like the ones in data/raw (one row per
+country, one column per year) are joined onto the bundled core.csv for an
+increasing number of metadata variables.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.Download_clean_data import CORE_DATA_PATH, join_indicators, melt_indicator
+
+VARIABLE_COUNTS = [8, 16, 32, 64, 128, 256]
+REPEATS = 3
+
+
+def make_indicator_files(countries, years, n_variables, seed=0):
+    rng = np.random.default_rng(seed)
+    files = {}
+    for i in range(n_variables):
+        df = pd.DataFrame(
+            rng.random((len(countries), len(years))), columns=[str(y) for y in years]
+        )
+        df.insert(0, "country", countries)
+        files[f"variable_{i}"] = df
+    return files
+
+
+def merge_loop(core_data, melted_indicators):
+    # The previous implementation: one merge per variable, each copying the
+    # growing frame.
+    merged_data = core_data
+    for df_melted in melted_indicators:
+        merged_data = merged_data.merge(
+            df_melted.reset_index(),
+            left_on=["country", "year"],
+            right_on=["country", "year"],
+            how="left",
+        )
+    return merged_data
+
+
+def best_time(func, *args):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    core_data = pd.read_csv(CORE_DATA_PATH)
+    countries = core_data["country"].unique()
+    years = range(1990, 2017)
+
+    print(f"core.csv: {len(core_data)} rows, {len(countries)} countries")
+    print(
+        f"{'variables':>9} {'merge loop (s)':>15} {'per var (ms)':>13} "
+        f"{'single join (s)':>16} {'per var (ms)':>13}"
+    )
+    for n_variables in VARIABLE_COUNTS:
+        files = make_indicator_files(countries, years, n_variables)
+        melted_indicators = [melt_indicator(df, name) for name, df in files.items()]
+
+        loop_time = best_time(merge_loop, core_data, melted_indicators)
+        join_time = best_time(join_indicators, core_data, melted_indicators)
+
+        print(
+            f"{n_variables:>9} {loop_time:>15.3f} {1000 * loop_time / n_variables:>13.2f} "
+            f"{join_time:>16.3f} {1000 * join_time / n_variables:>13.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Compare the response size of each Altair chart as HTML and as a Vega-Lite spec.
+
+Run from the root of the repository:
+
+    python -m bench.bench_payload
+
+The charts used to be sent as full HTML documents (`chart.to_html()`) into an
+iframe's srcDoc; they are now sent as Vega-Lite specs and drawn by vega-embed
+in the browser. For each chart, the HTML document is rebuilt from the spec the
+callback returns, and both are wrapped in a Dash callback response.
+"""
+
+import gzip
+import json
+
+import altair as alt
+import plotly
+from altair.utils.html import spec_to_html
+
+from src.app import app, country_list, default_country_list, disease_list
+
+SELECTIONS = {
+    "typical": dict(year=2015, year_range=[2000, 2010], countries=default_country_list),
+    "all countries": dict(year=2015, year_range=[2000, 2010], countries=country_list),
+}
+
+CHARTS = {
+    "country_chart_trend": "trend_query",
+    "disease_chart_trend": "trend_query",
+    "country_chart_snapshot": "snapshot_query",
+    "disease_chart_snapshot": "snapshot_query",
+}
+
+
+def callback(output):
+    return app.callback_map[output]["callback"].__wrapped__
+
+
+def response_bytes(component_id, prop, value):
+    """Size of a Dash callback response body, raw and gzipped."""
+    body = json.dumps(
+        {"response": {component_id: {prop: value}}, "multi": True},
+        cls=plotly.utils.PlotlyJSONEncoder,
+    ).encode()
+    return len(body), len(gzip.compress(body))
+
+
+def chart_spec(chart_id, selection, stat_type):
+    if CHARTS[chart_id] == "trend_query":
+        query = callback("trend_query.data")(
+            selection["year_range"], selection["countries"], disease_list, stat_type
+        )
+    else:
+        query = callback("snapshot_query.data")(
+            selection["year"], selection["countries"], disease_list, stat_type
+        )
+
+    args = [query, 10] if chart_id == "country_chart_snapshot" else [query]
+    return callback(f"{chart_id}_spec.data")(*args)
+
+
+def main():
+    print(
+        f"{'selection':<14} {'chart':<23} {'stat':<10} "
+        f"{'html (B)':>9} {'spec (B)':>9} {'ratio':>6} "
+        f"{'html gz':>8} {'spec gz':>8}"
+    )
+    for name, selection in SELECTIONS.items():
+        for chart_id in CHARTS:
+            for stat_type in ["raw_stats", "pc_k"]:
+                spec = chart_spec(chart_id, selection, stat_type)
+                html = spec_to_html(
+                    spec,
+                    mode="vega-lite",
+                    vega_version=alt.VEGA_VERSION,
+                    vegalite_version=alt.VEGALITE_VERSION,
+                    vegaembed_version=alt.VEGAEMBED_VERSION,
+                )
+                html_raw, html_gz = response_bytes(chart_id, "srcDoc", html)
+                spec_raw, spec_gz = response_bytes(f"{chart_id}_spec", "data", spec)
+                print(
+                    f"{name:<14} {chart_id:<23} {stat_type:<10} "
+                    f"{html_raw:>9} {spec_raw:>9} {spec_raw / html_raw:>6.2f} "
+                    f"{html_gz:>8} {spec_gz:>8}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Time and measure the peak memory of each stage of the data pipeline.
+
+Run from the root of the repository:
+
+    python -m bench.bench_pipeline
+    python -m bench.bench_pipeline --scales 1 10 --compare bench/results/pipeline-<commit>.json
+
+Each stage of src/Download_clean_data.py is run on the bundled data/raw files
+and on synthetic copies with 10x and 100x as many countries. Reference
+stages, which the pipeline no longer runs (a full read of core.csv, then a
+filter), are listed in parentheses and stored apart, under "reference", so that
+comparisons across commits only cover the stages the pipeline runs. Results are
+written to bench/results/pipeline-<commit>.json, which can be passed to
+--compare from a later commit to spot regressions.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from src.Download_clean_data import (
+    CORE_COLUMNS,
+    COUNTRY_ISO_PATH,
+    METADATA_PATH,
+    RAW_DATA_DIR,
+    enforce_schema,
+    filter_core_data,
+    join_indicators,
+    make_country_data,
+    make_disease_count_data,
+    read_core_data,
+    read_indicators,
+    to_feather_bytes,
+)
+
+RESULTS_DIR = os.path.join("bench", "results")
+
+
+def scale_raw_data(metadata, scale, raw_dir):
+    """Write copies of the raw files with `scale` times as many countries."""
+
+    def scale_countries(df):
+        copies = [df]
+        for i in range(1, scale):
+            copy = df.copy()
+            copy["country"] = copy["country"] + f" {i}"
+            copies.append(copy)
+        return pd.concat(copies, ignore_index=True)
+
+    for file_name in ["core.csv"] + list(metadata["File_name"]):
+        df = pd.read_csv(os.path.join(RAW_DATA_DIR, file_name))
+        scale_countries(df).to_csv(os.path.join(raw_dir, file_name), index=False)
+
+    ## The ISO lookup needs an entry for every copy of a country
+    scale_countries(pd.read_csv(COUNTRY_ISO_PATH)).to_csv(
+        os.path.join(raw_dir, "country_iso.csv"), index=False
+    )
+
+
+def measure(func, *args):
+    """Return (result, seconds, peak MB) for one call of `func`.
+
+    The function is timed without tracemalloc, then run again under it to
+    get the peak memory, so tracing overhead does not skew the timing.
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, seconds, peak / 1e6
+
+
+def run_stages(metadata, raw_dir, export_dir, country_iso_path=COUNTRY_ISO_PATH):
+    core_path = os.path.join(raw_dir, "core.csv")
+    stages = {}
+    reference = {}
+
+    def record(name, func, *args, results=stages):
+        result, seconds, peak_mb = measure(func, *args)
+        results[name] = {"seconds": round(seconds, 5), "peak_mb": round(peak_mb, 3)}
+        return result
+
+    ## Reference, not run by the pipeline: read all of core.csv, then filter,
+    ## as the pipeline did before streaming it
+    core_data = record(
+        "read_core_full",
+        lambda: pd.read_csv(core_path, usecols=list(CORE_COLUMNS), dtype=CORE_COLUMNS),
+        results=reference,
+    )
+    record("filter_core", filter_core_data, core_data, results=reference)
+
+    ## The stages of the pipeline
+    core_data = record("read_core_streaming", read_core_data, core_path)
+    melted_indicators = record("read_indicators", read_indicators, metadata, 1, raw_dir)
+    clean_data = record("merge", join_indicators, core_data, melted_indicators)
+    disease_count_data = record("disease_count", make_disease_count_data, clean_data)
+    country_data = record(
+        "iso_mapping", make_country_data, clean_data, country_iso_path
+    )
+
+    tables = {
+        "clean_data": clean_data,
+        "disease_count_data": disease_count_data,
+        "country_data": country_data,
+    }
+    tables = record(
+        "schema",
+        lambda: {
+            table_name: enforce_schema(table_name, table)
+            for table_name, table in tables.items()
+        },
+    )
+
+    def export():
+        for table_name, table in tables.items():
+            with open(os.path.join(export_dir, f"{table_name}.feather"), "wb") as f:
+                f.write(to_feather_bytes(table))
+
+    record("export", export)
+
+    stages["rows"] = {
+        "clean_data": len(clean_data),
+        "disease_count_data": len(disease_count_data),
+    }
+    stages["reference"] = reference
+    return stages
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_results(results, baseline=None):
+    for scale, stages in results["scales"].items():
+        print(f"\nscale {scale}x: {stages['rows']['clean_data']} rows in clean_data")
+        print(f"{'stage':<20} {'seconds':>9} {'peak MB':>9}", end="")
+        print(f" {'vs baseline':>12}" if baseline else "")
+        previous_stages = (baseline or {}).get("scales", {}).get(scale, {})
+        rows = [
+            (stage, numbers, previous_stages.get(stage))
+            for stage, numbers in stages.items()
+            if stage not in ("rows", "reference")
+        ] + [
+            (f"({stage})", numbers, previous_stages.get("reference", {}).get(stage))
+            for stage, numbers in stages.get("reference", {}).items()
+        ]
+        for stage, numbers, previous in rows:
+            print(
+                f"{stage:<20} {numbers['seconds']:>9.4f} {numbers['peak_mb']:>9.2f}",
+                end="",
+            )
+            if previous and previous["seconds"] > 0:
+                print(f" {numbers['seconds'] / previous['seconds']:>11.2f}x")
+            else:
+                print("")
+
+
+def main(args):
+    metadata = pd.read_csv(METADATA_PATH)
+    results = {
+        "commit": current_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "cpu_count": os.cpu_count(),
+        "scales": {},
+    }
+
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            raw_dir = RAW_DATA_DIR
+            country_iso_path = COUNTRY_ISO_PATH
+            if scale > 1:
+                raw_dir = os.path.join(tmp_dir, "raw")
+                os.makedirs(raw_dir)
+                scale_raw_data(metadata, scale, raw_dir)
+                country_iso_path = os.path.join(raw_dir, "country_iso.csv")
+            results["scales"][str(scale)] = run_stages(
+                metadata, raw_dir, tmp_dir, country_iso_path
+            )
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"pipeline-{results['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark each stage of the data pipeline."
+    )
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100],
+        help="multiples of the number of countries in the bundled raw files",
+    )
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    main(parser.parse_args())
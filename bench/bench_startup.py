@@ -0,0 +1,81 @@
+"""Break down the time it takes to import the app, like `python -X importtime`.
+
+Run from the root of the repository:
+
+    python -m bench.bench_startup
+    python -m bench.bench_startup --top 20
+
+`src.app` is imported in a fresh interpreter twice: a cold start, which
+compiles the chart templates, and a fast start, which reads them from the
+file the cold start saved. For each, the total import time is broken down by
+top-level package, from the self times that -X importtime reports.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+
+
+def import_times(templates_path):
+    """Self time of each imported module in microseconds, and the total."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import src.app"],
+        env=dict(os.environ, CHART_TEMPLATES_PATH=templates_path),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    self_times = Counter()
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.split("|")
+        self_times[name.strip()] += int(self_us.split(":")[1])
+        ## Top-level imports are indented by one space, nested ones by more
+        if not name.startswith("  "):
+            total += int(cumulative_us)
+    return self_times, total
+
+
+def by_package(self_times):
+    packages = Counter()
+    for module, self_us in self_times.items():
+        packages[module.split(".")[0]] += self_us
+    return packages
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        templates_path = os.path.join(tmp_dir, "chart_templates.json")
+        runs = {
+            "cold start": import_times(templates_path),
+            "fast start": import_times(templates_path),
+        }
+
+    packages = {name: by_package(self_times) for name, (self_times, _) in runs.items()}
+    top = Counter()
+    for counts in packages.values():
+        top.update(counts)
+
+    print(f"{'package':<28}" + "".join(f"{name:>12}" for name in runs) + "   (ms)")
+    for package, _ in top.most_common(args.top):
+        print(
+            f"{package:<28}"
+            + "".join(f"{packages[name][package] / 1000:>12.1f}" for name in runs)
+        )
+    print(
+        f"{'total':<28}"
+        + "".join(f"{total / 1000:>12.1f}" for _, total in runs.values())
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Break down the time it takes to import the app."
+    )
+    parser.add_argument("--top", type=int, default=15, help="packages to list")
+    main(parser.parse_args())
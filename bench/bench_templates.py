@@ -0,0 +1,120 @@
+"""Compare building each Altair chart per call with filling its spec template.
+
+Run from the root of the repository:
+
+    python -m bench.bench_templates
+
+The chart callbacks used to build the Altair chart and call `to_dict()` on
+every call. They now fill in the spec that make_chart_templates compiled at
+startup. Both paths are timed on the same query results, so only the chart
+construction is measured.
+"""
+
+import timeit
+import warnings
+
+from src import app, dataset
+from src.app import country_list, default_country_list, disease_list
+
+NUMBER = 50
+
+SELECTIONS = {
+    "typical": dict(year=2015, year_range=[2000, 2010], countries=default_country_list),
+    "all countries": dict(year=2015, year_range=[1990, 2015], countries=country_list),
+}
+
+
+def cases(selection, stat_type):
+    """(chart, build, fill) pairs of functions for one selection."""
+    trend = app.trend_result(
+        *selection["year_range"], selection["countries"], disease_list, stat_type
+    )
+    snapshot = app.snapshot_result(
+        selection["year"], selection["countries"], disease_list, stat_type
+    )
+    templates = app.spec_templates[stat_type]
+    first_year, last_year = selection["year_range"]
+    year = selection["year"]
+
+    column = dataset.value_column(stat_type != "raw_stats")
+    top_count = dataset.top_rows(snapshot["by_country"], column, 10)
+    counts = snapshot["by_country"][column]
+    min_count, max_count = counts.min(), counts.max()
+
+    return [
+        (
+            "country_chart_trend",
+            lambda: app.country_trend_chart(
+                trend["by_country"], stat_type, first_year, last_year
+            ).to_dict(),
+            lambda: app.fill_template(
+                templates["country_chart_trend"],
+                {"first_year": first_year, "last_year": last_year},
+                trend["by_country"],
+            ),
+        ),
+        (
+            "disease_chart_trend",
+            lambda: app.disease_trend_chart(
+                trend["by_disease"], stat_type, first_year, last_year
+            ).to_dict(),
+            lambda: app.fill_template(
+                templates["disease_chart_trend"],
+                {"first_year": first_year, "last_year": last_year},
+                trend["by_disease"],
+            ),
+        ),
+        (
+            "country_chart_snapshot",
+            lambda: app.country_snapshot_chart(
+                top_count, stat_type, year, 10, min_count, max_count
+            ).to_dict(),
+            lambda: app.fill_template(
+                templates["country_chart_snapshot"],
+                {
+                    "year": year,
+                    "number": 10,
+                    "min_count": min_count,
+                    "max_count": max_count,
+                },
+                top_count,
+            ),
+        ),
+        (
+            "disease_chart_snapshot",
+            lambda: app.disease_snapshot_chart(
+                snapshot["by_disease"], stat_type, year
+            ).to_dict(),
+            lambda: app.fill_template(
+                templates["disease_chart_snapshot"],
+                {"year": year},
+                snapshot["by_disease"],
+            ),
+        ),
+    ]
+
+
+def best_of(func):
+    return min(timeit.repeat(func, number=NUMBER, repeat=3)) / NUMBER
+
+
+def main():
+    print(
+        f"{'selection':<14} {'chart':<23} {'stat':<10} "
+        f"{'build (ms)':>11} {'fill (ms)':>10} {'speedup':>8}"
+    )
+    for name, selection in SELECTIONS.items():
+        for stat_type in ["raw_stats", "pc_k"]:
+            for chart_id, build, fill in cases(selection, stat_type):
+                build_ms = 1000 * best_of(build)
+                fill_ms = 1000 * best_of(fill)
+                print(
+                    f"{name:<14} {chart_id:<23} {stat_type:<10} "
+                    f"{build_ms:>11.3f} {fill_ms:>10.3f} {build_ms / fill_ms:>7.1f}x"
+                )
+
+
+if __name__ == "__main__":
+    ## Altair warns about the empty selections of the templates
+    warnings.simplefilter("ignore", UserWarning)
+    main()
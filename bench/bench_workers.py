@@ -0,0 +1,137 @@
+"""Measure the memory of gunicorn workers, with and without a preloaded app.
+
+Run from the root of the repository (Linux only, as it reads /proc):
+
+    python -m bench.bench_workers
+    python -m bench.bench_workers --workers 1 2 4 8
+
+For each number of workers, gunicorn is started with the settings of
+gunicorn.conf.py (app preloaded in the master) and with no settings (each
+worker imports the app itself). Once every worker has answered a few
+requests, /proc/<pid>/smaps_rollup gives each process's memory:
+
+- unique: private pages, which only this process uses
+- shared: pages shared with other processes, e.g. the preloaded app
+- PSS: unique pages plus this process's share of the shared pages, so the PSS
+  of all processes adds up to the memory that the whole server uses
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+REQUESTS = ["/", "/_dash-layout", "/_dash-dependencies", "/cache-stats"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def memory_kb(pid):
+    """Fields of /proc/<pid>/smaps_rollup, in kB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                fields[name] = int(value.split()[0])
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "shared": fields["Shared_Clean"] + fields["Shared_Dirty"],
+        "unique": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+
+def wait_until_ready(url, process, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited before serving requests")
+        try:
+            urllib.request.urlopen(url + "/cache-stats", timeout=5).read()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f"gunicorn did not serve requests within {timeout} s")
+
+
+def measure(workers, config, timeout):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--config",
+            config,
+            "--workers",
+            str(workers),
+            "--bind",
+            f"127.0.0.1:{port}",
+            "src.app:server",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(url, process, timeout)
+        ## Wait for every worker to boot, then spread requests over them
+        deadline = time.time() + timeout
+        while len(children(process.pid)) < workers and time.time() < deadline:
+            time.sleep(0.5)
+        time.sleep(2)
+        for _ in range(5 * workers):
+            for path in REQUESTS:
+                urllib.request.urlopen(url + path, timeout=30).read()
+
+        master = memory_kb(process.pid)
+        worker_memory = [memory_kb(pid) for pid in children(process.pid)]
+    finally:
+        process.terminate()
+        process.wait()
+    return master, worker_memory
+
+
+def main(args):
+    with tempfile.NamedTemporaryFile("w", suffix=".py") as no_config:
+        configs = {"preload": "gunicorn.conf.py", "no preload": no_config.name}
+        print(
+            f"{'mode':<11} {'workers':>7} {'worker unique':>14} {'worker shared':>14} "
+            f"{'master PSS':>11} {'total PSS':>10}   (MB)"
+        )
+        for mode, config in configs.items():
+            for workers in args.workers:
+                master, worker_memory = measure(workers, config, args.timeout)
+                unique = sum(w["unique"] for w in worker_memory) / len(worker_memory)
+                shared = sum(w["shared"] for w in worker_memory) / len(worker_memory)
+                total = master["pss"] + sum(w["pss"] for w in worker_memory)
+                print(
+                    f"{mode:<11} {workers:>7} {unique / 1024:>14.1f} "
+                    f"{shared / 1024:>14.1f} {master['pss'] / 1024:>11.1f} "
+                    f"{total / 1024:>10.1f}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the memory of gunicorn workers."
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument(
+        "--timeout", type=int, default=120, help="seconds to wait for the workers"
+    )
+    main(parser.parse_args())
@@ -0,0 +1,27 @@
+"""gunicorn settings, read by `gunicorn src.app:server` from the root of the
+repository. The number of workers comes from WEB_CONCURRENCY.
+
+The app is loaded once in the master process, before the workers are forked,
+so the workers share its memory copy-on-write: the imported libraries, the
+memory-mapped Feather files, the cubes, the chart templates and, with
+CHART_CACHE_WARM_UP=1, the warmed-up cache. Pages are only copied when a
+worker writes to them.
+"""
+
+import gc
+
+preload_app = True
+
+## The garbage collector writes to every object it tracks, which would copy
+## the preloaded app into each worker. It is kept off while the app loads,
+## the loaded objects are frozen out of its reach before each fork, and it is
+## turned back on in the workers (see the documentation of gc.freeze).
+gc.disable()
+
+
+def pre_fork(server, worker):
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
@@ -1,150 +1,521 @@
+import argparse
+import hashlib
+import io
+import json
 import os
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
 import pandas as pd
-import plotly.express as px
+
+CORE_DATA_URL = "https://raw.githubusercontent.com/UofTCoders/workshops-dc-py/master/data/processed/world-data-gapminder.csv"
+
+RAW_DATA_DIR = os.path.join("data", "raw")
+CORE_DATA_PATH = os.path.join(RAW_DATA_DIR, "core.csv")
+METADATA_PATH = os.path.join("data", "metadata.csv")
+COUNTRY_ISO_PATH = os.path.join("data", "country_iso.csv")
+MANIFEST_PATH = os.path.join("data", "manifest.json")
+PIPELINE_PATH = os.path.relpath(__file__)
+
+## Columns of core.csv used downstream, and the rows we keep
+CORE_COLUMNS = {"country": str, "year": int, "region": str, "sub_region": str}
+REGIONS = ["Africa", "Americas", "Asia", "Europe", "Oceania"]
+FIRST_YEAR = 1990  # Child death data is available from 1990
+
+# Schema
+## Every exported table must have its columns, with values in range. Strings
+## are stored as categoricals where that makes them smaller, years as int16,
+## and floats as float32 where that does not change any recorded value.
+TABLE_COLUMNS = {
+    "clean_data": ["country", "year", "region", "sub_region"],
+    "disease_count_data": ["country", "year", "disease", "count", "ncu5"],
+    "country_data": ["country", "sub_region", "iso_alpha"],
+}
+
+COLUMN_DTYPES = {
+    "country": "category",
+    "region": "category",
+    "sub_region": "category",
+    "disease": "category",
+    "iso_alpha": "category",
+    "year": "int16",
+}
+
+## Inclusive (min, max) bounds; None means unbounded
+VALUE_RANGES = {
+    "year": (FIRST_YEAR, np.iinfo(np.int16).max),
+    "count": (0, None),
+    "ncu5": (0, None),
+}
+
+## Columns that identify a row and must never be missing
+KEY_COLUMNS = ["country", "year", "disease", "iso_alpha"]
+
+
+def fits_float32(values):
+    """True if every value prints back as the same number after a float32 cast.
+
+    The app widens float32 columns through their shortest decimal form, so this
+    guarantees it reads the values that were recorded.
+    """
+    ## Formatting is slow, so only check each distinct value once
+    values = np.unique(np.asarray(values, dtype=np.float64))
+    widened = values.astype(np.float32).astype(str).astype(np.float64)
+    return np.array_equal(widened, values, equal_nan=True)
+
+
+def category_is_smaller(values):
+    """True if a column takes less memory as a categorical, i.e. its values
+    repeat enough to pay for the codes and the categories."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return True
+    return values.astype("category").memory_usage(
+        index=False, deep=True
+    ) < values.memory_usage(index=False, deep=True)
+
+
+def validate_table(table_name, table):
+    problems = []
+
+    missing_columns = set(TABLE_COLUMNS[table_name]) - set(table.columns)
+    if missing_columns:
+        problems.append(f"missing columns {sorted(missing_columns)}")
+
+    for column in table.columns.intersection(KEY_COLUMNS):
+        if table[column].isna().any():
+            problems.append(f"missing values in {column}")
+
+    for column, (low, high) in VALUE_RANGES.items():
+        if column not in table.columns:
+            continue
+        values = table[column].dropna()
+        if (low is not None and (values < low).any()) or (
+            high is not None and (values > high).any()
+        ):
+            problems.append(f"{column} outside [{low}, {high}]")
+
+    if problems:
+        raise ValueError(
+            f"{table_name} does not match its schema: {'; '.join(problems)}"
+        )
+
+
+def enforce_schema(table_name, table):
+    """Validate a table and return a copy with compact dtypes.
+
+    `table_name` may include a partition, e.g. region=Africa/clean_data.
+    """
+    table_name = os.path.basename(table_name)
+    validate_table(table_name, table)
+
+    dtypes = {}
+    for column in table.columns:
+        if COLUMN_DTYPES.get(column) == "category":
+            if category_is_smaller(table[column]):
+                dtypes[column] = "category"
+        elif column in COLUMN_DTYPES:
+            dtypes[column] = COLUMN_DTYPES[column]
+        elif table[column].dtype == np.float64 and fits_float32(table[column]):
+            dtypes[column] = "float32"
+
+    return table.astype(dtypes)
+
+
+# Manifest helpers
+## The manifest records content hashes of the raw inputs and derived outputs
+## of every stage, so a rebuild only redoes stages whose inputs changed.
+
+
+def hash_bytes(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {"download": {}, "stages": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def write_if_changed(path, content):
+    """Write `content` to `path` unless the file already holds the same bytes."""
+    if os.path.exists(path) and hash_file(path) == hash_bytes(content):
+        return False
+    with open(path, "wb") as f:
+        f.write(content)
+    return True
+
+
+def partition_table(region, table_name):
+    """Name of a table within a region's partition, e.g. region=Africa/clean_data."""
+    return os.path.join(f"region={region}", table_name)
+
+
+def table_path(table_name):
+    return os.path.join("data", f"{table_name}.feather")
+
+
+def to_feather_bytes(table):
+    """Serialize a table as uncompressed Feather so the app can memory-map it."""
+    sink = io.BytesIO()
+    table.reset_index(drop=True).to_feather(sink, compression="uncompressed")
+    return sink.getvalue()
+
+
+def memory_mb(table):
+    return table.memory_usage(index=False, deep=True).sum() / 1e6
+
+
+def export_tables(tables):
+    for table_name, table in tables.items():
+        path = table_path(table_name)
+        compact_table = enforce_schema(table_name, table)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        written = write_if_changed(path, to_feather_bytes(compact_table))
+        print(
+            f"  {path}: {'written' if written else 'unchanged'}, "
+            f"{memory_mb(table):.3f} MB -> {memory_mb(compact_table):.3f} MB in memory"
+        )
+
+
+def run_stage(name, inputs, table_names, build, manifest, force=False, params=None):
+    """Rebuild a stage only when its inputs, parameters or outputs differ from the
+    manifest."""
+    input_hashes = {path: hash_file(path) for path in inputs}
+    outputs = [table_path(table_name) for table_name in table_names]
+    record = manifest["stages"].get(name)
+
+    if (
+        not force
+        and record is not None
+        and record["inputs"] == input_hashes
+        and record.get("params") == params
+        and all(
+            os.path.exists(path) and hash_file(path) == record["outputs"].get(path)
+            for path in outputs
+        )
+    ):
+        print(f"{name}: inputs unchanged, skipping")
+        return False
+
+    print(f"{name}: rebuilding")
+    export_tables(build())
+    manifest["stages"][name] = {
+        "inputs": input_hashes,
+        "params": params,
+        "outputs": {path: hash_file(path) for path in outputs},
+    }
+    return True
+
 
 # Download files
 ## Key variables from 1800
 
-core_data = pd.read_csv(
-    "https://raw.githubusercontent.com/UofTCoders/workshops-dc-py/master/data/processed/world-data-gapminder.csv"
-)
 
-core_data.to_csv("data/raw/core.csv", header=True, index=False)
+def download_core_data(manifest, path=CORE_DATA_PATH):
+    """Download core.csv, rewriting it only if the remote file has changed."""
+    download = manifest["download"]
+    request = urllib.request.Request(CORE_DATA_URL)
+    if download.get("etag") and os.path.exists(path):
+        request.add_header("If-None-Match", download["etag"])
 
-# Read in data
-## Metadata
-metadata = pd.read_csv("data/metadata.csv")
+    try:
+        with urllib.request.urlopen(request) as response:
+            content = response.read()
+            etag = response.headers.get("ETag")
+    except urllib.error.HTTPError as error:
+        if error.code == 304:
+            print("download: core.csv not modified")
+            return
+        raise
 
-## Core data
-core_data = pd.read_csv("data/raw/core.csv")
+    remote_hash = hash_bytes(content)
+    if remote_hash == download.get("sha256") and os.path.exists(path):
+        print("download: core.csv unchanged")
+    else:
+        core_data = pd.read_csv(io.BytesIO(content))
+        core_data.to_csv(path, header=True, index=False)
+        print("download: core.csv updated")
 
-## Other data files
-data_files = {}
+    download["sha256"] = remote_hash
+    download["etag"] = etag
 
-for file_name, variable_name in zip(metadata["File_name"], metadata["Variable_name"]):
-    data_files[variable_name] = pd.read_csv(os.path.join("data", "raw", file_name))
 
 # Clean data
-merged_data = core_data
 
-for variable_name in metadata["Variable_name"]:
-    ## Reshape data files into long form
-    df_to_merge = data_files[variable_name]
 
-    df_to_merge_melted = pd.melt(
-        df_to_merge,
+def melt_indicator(df, variable_name):
+    """Reshape a wide indicator file into a long frame indexed by country and year."""
+    df_melted = pd.melt(
+        df,
         id_vars=["country"],
         var_name="year",
         value_name=variable_name,
     )
 
-    df_to_merge_melted["year"] = df_to_merge_melted["year"].astype(int)
+    df_melted["year"] = df_melted["year"].astype(int)
 
-    ## Merge with core_data
-    merged_data = merged_data.merge(
-        df_to_merge_melted,
-        left_on=["country", "year"],
-        right_on=["country", "year"],
-        how="left",
+    return df_melted.set_index(["country", "year"])
+
+
+def read_indicator(file_name, variable_name, raw_dir=RAW_DATA_DIR):
+    return melt_indicator(pd.read_csv(os.path.join(raw_dir, file_name)), variable_name)
+
+
+def read_indicators(metadata, workers=1, raw_dir=RAW_DATA_DIR):
+    """Read and melt every indicator file, using a process pool if `workers` > 1.
+
+    Results are returned in the order of `metadata`, whatever order the
+    workers finish in.
+    """
+    file_names = list(metadata["File_name"])
+    variable_names = list(metadata["Variable_name"])
+    read = partial(read_indicator, raw_dir=raw_dir)
+
+    if workers <= 1:
+        return list(map(read, file_names, variable_names))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(read, file_names, variable_names))
+
+
+def join_indicators(core_data, melted_indicators):
+    """Left-join every melted indicator onto core_data in a single pass.
+
+    Each indicator is aligned on core_data's (country, year) keys and all of
+    them are added at once, so core_data is only copied once no matter how
+    many variables there are.
+    """
+    keys = pd.MultiIndex.from_frame(core_data[["country", "year"]])
+    indicators = pd.DataFrame(
+        {
+            df.columns[0]: df.iloc[:, 0].reindex(keys).to_numpy()
+            for df in melted_indicators
+        },
+        index=core_data.index,
+    )
+
+    return pd.concat([core_data, indicators], axis=1)
+
+
+def filter_core_data(core_data, regions=REGIONS):
+    return core_data.loc[
+        (core_data["region"].isin(regions)) & (core_data["year"] >= FIRST_YEAR)
+    ]
+
+
+def read_core_data(path=CORE_DATA_PATH, regions=REGIONS, chunksize=10_000):
+    """Stream core.csv in chunks, keeping only the rows and columns we use.
+
+    The region and year filters are applied to each chunk as it is read, so
+    peak memory depends on the chunk size and the selected rows, not on the
+    size of the file.
+    """
+    chunks = pd.read_csv(
+        path, usecols=list(CORE_COLUMNS), dtype=CORE_COLUMNS, chunksize=chunksize
+    )
+
+    return pd.concat(
+        [filter_core_data(chunk, regions) for chunk in chunks], ignore_index=True
     )
 
-## Get data for Africa
-merged_data = merged_data.loc[
-    merged_data["region"] == "Africa",
-]
 
-## Get data after 1990, when child death data is available
-merged_data = merged_data.loc[
-    merged_data["year"] >= 1990,
-]
+def build_clean_data(regions=REGIONS, workers=1, chunksize=10_000):
+    ## Metadata
+    metadata = pd.read_csv(METADATA_PATH)
+
+    ## Core data, for the selected regions after 1990
+    core_data = read_core_data(regions=regions, chunksize=chunksize)
+
+    ## Reshape other data files into long form
+    melted_indicators = read_indicators(metadata, workers=workers)
+
+    ## Merge with core_data
+    clean_data = join_indicators(core_data, melted_indicators)
+
+    ## Split into one partition per region
+    return {
+        partition_table(region, "clean_data"): clean_data.loc[
+            clean_data["region"] == region
+        ]
+        for region in regions
+    }
 
-## Remove `child_mortality` column, which is duplicated
-clean_data = merged_data.drop("child_mortality", axis=1)
 
 # Create datasets for analyses and visualizations
 
-## Define new dataset to present disease
-disease_count_data = clean_data[
-    [
+
+def make_disease_count_data(clean_data):
+    ## Define the fact table: one row per country, year and disease
+    disease_count_data = clean_data[
+        [
+            "country",
+            "year",
+            "hiv_deaths_in_children_1_59_months_total_deaths",
+            "malaria_deaths_in_children_1_59_months_total_deaths",
+            "measles_deaths_in_children_1_59_months_total_deaths",
+            "meningitis_deaths_in_children_1_59_months_total_deaths",
+            "ncd_deaths_in_children_1_59_months_total_deaths",
+            "number_of_child_deaths",
+        ]
+    ]
+
+    disease_count_data.columns = [
         "country",
         "year",
-        "sub_region",
-        "hiv_deaths_in_children_1_59_months_total_deaths",
-        "malaria_deaths_in_children_1_59_months_total_deaths",
-        "measles_deaths_in_children_1_59_months_total_deaths",
-        "meningitis_deaths_in_children_1_59_months_total_deaths",
-        "ncd_deaths_in_children_1_59_months_total_deaths",
-        "number_of_child_deaths",
+        "HIV",
+        "Malaria",
+        "Measles",
+        "Meningitis",
+        "NCD",
+        "total_child_deaths",
     ]
-]
-
-disease_count_data.columns = [
-    "country",
-    "year",
-    "sub_region",
-    "HIV",
-    "Malaria",
-    "Measles",
-    "Meningitis",
-    "NCD",
-    "total_child_deaths",
-]
-
-disease_count_data = pd.melt(
-    disease_count_data,
-    id_vars=["country", "year", "sub_region"],
-    var_name="disease",
-    value_name="count",
-)
-
-## Define per-child data
-pc_data = clean_data[["country", "year", "number_of_under_five_years_children"]]
-
-pc_data.columns = ["country", "year", "ncu5"]
-
-disease_count_data_pc = pd.merge(
-    disease_count_data, pc_data, on=["country", "year"], how="left"
-)
-
-disease_count_data_pc["count_pkc"] = (
-    1000 * disease_count_data_pc["count"] / disease_count_data_pc["ncu5"]
-)
-
-## Define map data
-country_iso = (
-    px.data.gapminder()
-    .query("continent=='Africa'")[["country", "iso_alpha"]]
-    .drop_duplicates()
-    .reset_index(drop=True)
-)
-
-### Add South Sudan and Seychelles
-country_iso = country_iso.append(
-    pd.DataFrame(
-        {"country": ["South Sudan", "Seychelles"], "iso_alpha": ["SSD", "SYC"]}
+
+    disease_count_data = pd.melt(
+        disease_count_data,
+        id_vars=["country", "year"],
+        var_name="disease",
+        value_name="count",
+    )
+
+    ### Add the number of 0-4 year-olds, used for per-child statistics
+    pc_data = clean_data[["country", "year", "number_of_under_five_years_children"]]
+
+    pc_data.columns = ["country", "year", "ncu5"]
+
+    return pd.merge(disease_count_data, pc_data, on=["country", "year"], how="left")
+
+
+def make_country_data(clean_data, country_iso_path=COUNTRY_ISO_PATH):
+    ## Define the country dimension table: sub-region and ISO code for maps
+    ### ISO codes come from a lookup table covering every country in core.csv
+    country_iso = pd.read_csv(country_iso_path, dtype=str)
+
+    country_data = pd.merge(
+        clean_data[["country", "sub_region"]].drop_duplicates(),
+        country_iso,
+        on="country",
+        how="left",
     )
-)
 
-disease_count_map_data = pd.DataFrame.merge(
-    disease_count_data, country_iso, on="country", how="left"
-)
+    ## iso_alpha is a key column, so the schema would reject the table anyway,
+    ## without naming the countries to add to the lookup table
+    missing = country_data.loc[country_data["iso_alpha"].isna(), "country"]
+    if len(missing):
+        raise ValueError(f"no ISO code in {country_iso_path} for: {', '.join(missing)}")
+
+    return country_data
+
+
+def build_disease_count_data(region):
+    clean_data = pd.read_feather(table_path(partition_table(region, "clean_data")))
+
+    return {
+        partition_table(region, "disease_count_data"): make_disease_count_data(
+            clean_data
+        ),
+        partition_table(region, "country_data"): make_country_data(clean_data),
+    }
 
-disease_count_map_data_pc = pd.merge(
-    disease_count_data_pc, country_iso, on="country", how="left"
-)
 
-# Export pre-processed datasets
-clean_data.to_pickle("data/clean_data.pkl", protocol=4)
-clean_data.to_csv("data/clean_data.csv")
+# Run pipeline
 
-disease_count_data.to_pickle("data/disease_count_data.pkl", protocol=4)
-disease_count_data.to_csv("data/disease_count_data.csv")
 
-disease_count_data_pc.to_pickle("data/disease_count_data_pc.pkl", protocol=4)
-disease_count_data_pc.to_csv("data/disease_count_data_pc.csv")
+def main(args):
+    manifest = {"download": {}, "stages": {}} if args.force else load_manifest()
 
-disease_count_map_data.to_pickle("data/disease_count_map_data.pkl", protocol=4)
-disease_count_map_data.to_csv("data/disease_count_map_data.csv")
+    if not args.offline:
+        download_core_data(manifest)
 
-disease_count_map_data_pc.to_pickle("data/disease_count_map_data_pc.pkl", protocol=4)
-disease_count_map_data_pc.to_csv("data/disease_count_map_data_pc.csv")
\ No newline at end of file
+    metadata = pd.read_csv(METADATA_PATH)
+    raw_files = [
+        os.path.join(RAW_DATA_DIR, file_name) for file_name in metadata["File_name"]
+    ]
+
+    run_stage(
+        "clean_data",
+        [PIPELINE_PATH, METADATA_PATH, CORE_DATA_PATH] + raw_files,
+        [partition_table(region, "clean_data") for region in args.regions],
+        partial(
+            build_clean_data,
+            regions=args.regions,
+            workers=args.workers,
+            chunksize=args.chunksize,
+        ),
+        manifest,
+        force=args.force,
+        params={"regions": args.regions},
+    )
+
+    ## Derived tables are rebuilt per region, only for partitions that changed
+    for region in args.regions:
+        run_stage(
+            partition_table(region, "disease_count_data"),
+            [
+                PIPELINE_PATH,
+                COUNTRY_ISO_PATH,
+                table_path(partition_table(region, "clean_data")),
+            ],
+            [
+                partition_table(region, "disease_count_data"),
+                partition_table(region, "country_data"),
+            ],
+            partial(build_disease_count_data, region),
+            manifest,
+            force=args.force,
+        )
+
+    save_manifest(manifest)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download and clean the Gapminder data used by the app."
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="use the existing data/raw/core.csv instead of downloading it",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="ignore data/manifest.json and rebuild every stage",
+    )
+    parser.add_argument(
+        "--regions",
+        nargs="+",
+        choices=REGIONS,
+        default=REGIONS,
+        help="regions to build, each written to its own data/region=<name>/ partition",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes used to read and reshape the indicator files",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=10_000,
+        help="number of rows of core.csv read at a time",
+    )
+    main(parser.parse_args())
@@ -1,25 +1,23 @@
-import altair as alt
 import dash
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
-import nbformat
-import plotly.graph_objects as go
-import plotly.express as px
+from dash.dependencies import ClientsideFunction, Input, Output, State
+import plotly
 
 import pandas as pd
 import os
+import re
+import json
+import time
+import warnings
+import flask
+from importlib.metadata import version
 
-# Import data
-clean_data = pd.read_pickle("data/clean_data.pkl")
-disease_count_data = pd.read_pickle("data/disease_count_data.pkl")
-disease_count_data_pc = pd.read_pickle("data/disease_count_data_pc.pkl")
-disease_count_map_data = pd.read_pickle("data/disease_count_map_data.pkl")
-disease_count_map_data_pc = pd.read_pickle("data/disease_count_map_data_pc.pkl")
+from src import cache, compression, dataset, metrics, profiling
 
 ## Make country and disease lists
-country_list = list(clean_data["country"].unique())
+country_list = list(dataset.country_data["country"])
 
 disease_list = [
     "HIV",
@@ -43,8 +41,28 @@ default_country_list = [
     "Guinea",
 ]
 
+### Deployments that do not serve Africa start with the first few countries
+if not set(default_country_list) & set(country_list):
+    default_country_list = country_list[:10]
+
+## Default year range of the Trend tab and number of countries of the Snapshot tab
+default_year_range = [2000, 2010]
+default_number_countries = 10
+
+## Title and map scope for the served regions
+region_name = " and ".join(dataset.regions)
+
+geo_scopes = {"Africa": "africa", "Asia": "asia", "Europe": "europe"}
+geo_scope = geo_scopes.get(dataset.regions[0], "world")
+if len(dataset.regions) > 1:
+    geo_scope = "world"
+
 colors = {"title": "#ffd17a", "background": "white", "controls": "#f3ff94"}
 
+## Opt-in client-side filtering: the dataset and chart templates are sent to
+## the browser once, and the query and chart callbacks run there
+clientside_filtering = os.environ.get("CLIENTSIDE_FILTERING") == "1"
+
 # Define elements
 
 ## Trend tab
@@ -70,7 +88,7 @@ year_range_controller_trend = html.Div(
             id="year_range_widget_trend",
             min=1990,
             max=2015,
-            value=[2000, 2010],
+            value=default_year_range,
             marks={
                 1990: "1990",
                 1995: "1995",
@@ -155,6 +173,7 @@ year_controller_snapshot = html.Div(
             min=1990,
             max=2015,
             value=2015,
+            updatemode="drag",
             marks={
                 1990: "1990",
                 1995: "1995",
@@ -230,13 +249,19 @@ default_number_selector_snapshot = html.Div(
         dcc.Dropdown(
             id="default_number_widget_snapshot",
             options=[{"label": str(n), "value": n} for n in range(5, 15)],
-            value=10,
+            value=default_number_countries,
             style=dict(width="40%", verticalAlign="middle"),
         ),
     ],
     style=dict(display="flex"),
 )
 
+## Client-side filtering
+### Filled in below the chart callbacks: the map templates always, the
+### dataset and the other templates when client-side filtering is enabled
+clientside_dataset = dcc.Store(id="clientside_dataset")
+chart_templates = dcc.Store(id="chart_templates")
+
 ## information tab
 table_header = [
     html.Thead(
@@ -317,18 +342,74 @@ information_tab = [
 ]
 
 # Define app
-app = dash.Dash(external_stylesheets=[dbc.themes.BOOTSTRAP])
+## The Vega scripts for the Altair charts are added along with the chart
+## templates, at the end of this file
+app = dash.Dash(
+    assets_folder=os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets"),
+    external_stylesheets=[dbc.themes.BOOTSTRAP],
+    compress=False,
+)
 
 server = app.server
 
+
+def server_callback(*args, **kwargs):
+    """Register a query or chart callback, unless it runs in the browser."""
+    if clientside_filtering:
+        return lambda func: func
+    return app.callback(*args, **kwargs)
+
+
+## Chart outputs are cached on normalized inputs, for as long as the app and
+## query code, the data, the served regions and the versions of the libraries
+## of the pickled outputs stay the same
+chart_cache = cache.CallbackCache(
+    version=cache.fingerprint(
+        [__file__, dataset.__file__, cache.__file__, "data/manifest.json"],
+        dataset.regions + [version("pandas"), version("numpy")],
+    )
+)
+
+
+@server.route("/cache-stats")
+def cache_stats():
+    return flask.jsonify(chart_cache.stats())
+
+
+## Latency, response size, calls and errors of each callback, for Prometheus
+callback_metrics = metrics.CallbackMetrics()
+callback_metrics.instrument(server)
+
+## Opt-in profiling of callbacks into collapsed-stack files, see src/profiling.py
+if profiling.PROFILE_DIR:
+    profiling.CallbackProfiler(
+        profiling.PROFILE_DIR, profiling.PROFILE_OUTPUT
+    ).instrument(server)
+
+## Responses are compressed with brotli or gzip, and carry an ETag so that
+## unchanged ones are answered with a 304, see src/compression.py. Set up after
+## the metrics and the profiler, whose hooks then run last and see the response
+## that is sent
+compression.compress(server)
+compression.add_etags(server)
+
+
+@server.route("/metrics")
+def callback_metrics_text():
+    return flask.Response(
+        callback_metrics.render(), mimetype="text/plain; version=0.0.4"
+    )
+
+
 app.layout = dbc.Container(
     [
         dbc.Tabs(
             [
                 dbc.Tab(
                     [
+                        dcc.Store(id="snapshot_query"),
                         html.H1(
-                            "Child Diseases and Mortality in Africa, 1990 - 2015",
+                            f"Child Diseases and Mortality in {region_name}, 1990 - 2015",
                             style={
                                 "backgroundColor": colors["title"],
                                 "padding": 20,
@@ -449,10 +530,12 @@ app.layout = dbc.Container(
                                     [
                                         dbc.Col(
                                             [
-                                                html.Iframe(
+                                                dcc.Store(
+                                                    id="country_chart_snapshot_spec"
+                                                ),
+                                                html.Div(
                                                     id="country_chart_snapshot",
                                                     style={
-                                                        "border-width": "0",
                                                         "width": "100%",
                                                         "height": "60vh",
                                                     },
@@ -460,22 +543,27 @@ app.layout = dbc.Container(
                                             ]
                                         ),
                                         dbc.Col(
-                                            dcc.Graph(
-                                                id="map_snapshot",
-                                                style={
-                                                    "border-width": "0",
-                                                    "width": "100%",
-                                                    "height": "50vh",
-                                                },
-                                            )
+                                            [
+                                                dcc.Store(id="map_snapshot_data"),
+                                                dcc.Graph(
+                                                    id="map_snapshot",
+                                                    style={
+                                                        "border-width": "0",
+                                                        "width": "100%",
+                                                        "height": "50vh",
+                                                    },
+                                                ),
+                                            ]
                                         ),
                                         dbc.Col(
                                             [
                                                 "",
-                                                html.Iframe(
+                                                dcc.Store(
+                                                    id="disease_chart_snapshot_spec"
+                                                ),
+                                                html.Div(
                                                     id="disease_chart_snapshot",
                                                     style={
-                                                        "border-width": "0",
                                                         "width": "100%",
                                                         "height": "60vh",
                                                     },
@@ -491,8 +579,9 @@ app.layout = dbc.Container(
                 ),
                 dbc.Tab(
                     [
+                        dcc.Store(id="trend_query"),
                         html.H1(
-                            "Trends of Child Diseases and Mortality in Africa, 1990 - 2015",
+                            f"Trends of Child Diseases and Mortality in {region_name}, 1990 - 2015",
                             style={
                                 "backgroundColor": colors["title"],
                                 "padding": 20,
@@ -594,10 +683,12 @@ app.layout = dbc.Container(
                                     [
                                         dbc.Col(
                                             [
-                                                html.Iframe(
+                                                dcc.Store(
+                                                    id="country_chart_trend_spec"
+                                                ),
+                                                html.Div(
                                                     id="country_chart_trend",
                                                     style={
-                                                        "border-width": "0",
                                                         "width": "100%",
                                                         "height": "50vh",
                                                     },
@@ -606,10 +697,12 @@ app.layout = dbc.Container(
                                         ),
                                         dbc.Col(
                                             [
-                                                html.Iframe(
+                                                dcc.Store(
+                                                    id="disease_chart_trend_spec"
+                                                ),
+                                                html.Div(
                                                     id="disease_chart_trend",
                                                     style={
-                                                        "border-width": "0",
                                                         "width": "100%",
                                                         "height": "50vh",
                                                     },
@@ -625,132 +718,149 @@ app.layout = dbc.Container(
                 ),
                 dbc.Tab(information_tab, label="Data Source and Explanation"),
             ]
-        )
+        ),
+        clientside_dataset,
+        chart_templates,
     ],
     fluid=True,
     style={"max-width": "95%", "backgroundColor": colors["background"]},
 )
 
 
-@app.callback(
-    Output("year_display_snapshot", "children"), Input("year_widget_snapshot", "value")
+## The year displays and the select all / deselect all checklists run in the
+## browser, in both modes: dragging the year slider or ticking a checklist
+## only sends a request for the charts, and none with client-side filtering
+app.clientside_callback(
+    ClientsideFunction(namespace="widgets", function_name="yearDisplay"),
+    Output("year_display_snapshot", "children"),
+    Input("year_widget_snapshot", "value"),
 )
-def selector_all_trend(selected):
-    return f"Selected year: {selected}"
-
-
-@app.callback(
-    Output("year_display_trend", "children"), Input("year_range_widget_trend", "value")
+app.clientside_callback(
+    ClientsideFunction(namespace="widgets", function_name="yearRangeDisplay"),
+    Output("year_display_trend", "children"),
+    Input("year_range_widget_trend", "value"),
 )
-def selector_all_trend(selected):
-    return f"Selected year range: {selected}"
+for tab in ["trend", "snapshot"]:
+    app.clientside_callback(
+        ClientsideFunction(namespace="widgets", function_name="selectAll"),
+        Output(f"country_widget_{tab}", "value"),
+        Input(f"select_all_{tab}", "value"),
+        Input(f"deselect_all_{tab}", "value"),
+        State(f"country_widget_{tab}", "options"),
+        State(f"country_widget_{tab}", "value"),
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace="widgets", function_name="updateDeselectAll"),
+        Output(f"deselect_all_{tab}", "value"),
+        Input(f"select_all_{tab}", "value"),
+        Input(f"country_widget_{tab}", "value"),
+        State(f"deselect_all_{tab}", "value"),
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace="widgets", function_name="updateSelectAll"),
+        Output(f"select_all_{tab}", "value"),
+        Input(f"deselect_all_{tab}", "value"),
+        Input(f"country_widget_{tab}", "value"),
+        State(f"select_all_{tab}", "value"),
+    )
 
 
-@app.callback(
-    Output("country_widget_trend", "value"),
-    Input("select_all_trend", "value"),
-    Input("deselect_all_trend", "value"),
-    State("country_widget_trend", "options"),
-    State("country_widget_trend", "value"),
-)
-def selector_all_trend(selected, deselected, options, value):
-    if 1 in selected:
-        return [i["value"] for i in options]
-    elif 0 in deselected:
-        return []
-    else:
-        return value
+# Define queries
+## Each tab's widgets are turned into one normalized query, stored in a
+## dcc.Store that all of the tab's charts take as input. The query result is
+## computed once per worker and shared by the charts through the chart cache.
 
 
-@app.callback(
-    Output("deselect_all_trend", "value"),
-    Input("select_all_trend", "value"),
-    Input("country_widget_trend", "value"),
-    State("deselect_all_trend", "value"),
-)
-def update_deselector_all_trend(select_all, selected, deselect_all):
-    if 1 in select_all or selected:
-        return []
-    else:
-        return deselect_all
+@chart_cache.memoize("trend_result", countries=cache.as_set, diseases=cache.as_set)
+def trend_result(first_year, last_year, countries, diseases, stat_type):
+    ## Summed on the server, so the charts get one row per country or disease
+    ## and year rather than one per country, year and disease
+    per_capita = stat_type != "raw_stats"
+    return {
+        "by_country": dataset.trend_by_country(
+            first_year, last_year, countries, diseases, per_capita
+        ),
+        "by_disease": dataset.trend_by_disease(
+            first_year, last_year, countries, diseases, per_capita
+        ),
+    }
 
 
-@app.callback(
-    Output("select_all_trend", "value"),
-    Input("deselect_all_trend", "value"),
-    Input("country_widget_trend", "value"),
-    State("select_all_trend", "value"),
-)
-def update_selector_all_trend(deselect_all, selected, select_all):
-    if 0 in deselect_all or selected:
-        return []
-    else:
-        return select_all
+@chart_cache.memoize("snapshot_result", countries=cache.as_set, diseases=cache.as_set)
+def snapshot_result(year, countries, diseases, stat_type):
+    per_capita = stat_type != "raw_stats"
+    return {
+        "by_country": dataset.totals_by_country(year, countries, diseases, per_capita),
+        "by_disease": dataset.totals_by_disease(year, countries, diseases, per_capita),
+    }
 
 
-@app.callback(
-    Output("country_widget_snapshot", "value"),
-    Input("select_all_snapshot", "value"),
-    Input("deselect_all_snapshot", "value"),
-    State("country_widget_snapshot", "options"),
-    State("country_widget_snapshot", "value"),
+@server_callback(
+    Output("trend_query", "data"),
+    Input("year_range_widget_trend", "value"),
+    Input("country_widget_trend", "value"),
+    Input("disease_widget_trend", "value"),
+    Input("stat_type_widget_trend", "value"),
 )
-def selector_all_snapshot(selected, deselected, options, value):
-    if 1 in selected:
-        return [i["value"] for i in options]
-    elif 0 in deselected:
-        return []
-    else:
-        return value
+def query_trend(year_range, countries, diseases, stat_type):
+    query = {
+        "first_year": year_range[0],
+        "last_year": year_range[1],
+        "countries": cache.as_set(countries),
+        "diseases": cache.as_set(diseases),
+        "stat_type": stat_type,
+    }
+    trend_result(**query)
+    return query
 
 
-@app.callback(
-    Output("deselect_all_snapshot", "value"),
-    Input("select_all_snapshot", "value"),
+@server_callback(
+    Output("snapshot_query", "data"),
+    Input("year_widget_snapshot", "value"),
     Input("country_widget_snapshot", "value"),
-    State("deselect_all_snapshot", "value"),
+    Input("disease_widget_snapshot", "value"),
+    Input("stat_type_widget_snapshot", "value"),
 )
-def update_deselector_all_snapshot(select_all, selected, deselect_all):
-    if 1 in select_all or selected:
-        return []
-    else:
-        return deselect_all
+def query_snapshot(year, countries, diseases, stat_type):
+    query = {
+        "year": year,
+        "countries": cache.as_set(countries),
+        "diseases": cache.as_set(diseases),
+        "stat_type": stat_type,
+    }
+    snapshot_result(**query)
+    return query
 
 
-@app.callback(
-    Output("select_all_snapshot", "value"),
-    Input("deselect_all_snapshot", "value"),
-    Input("country_widget_snapshot", "value"),
-    State("select_all_snapshot", "value"),
-)
-def update_selector_all_snapshot(deselect_all, selected, select_all):
-    if 0 in deselect_all or selected:
-        return []
-    else:
-        return select_all
+# Define charts
+## Altair charts are sent as Vega-Lite specs to a dcc.Store next to each chart,
+## and drawn in the browser by vega-embed, rather than as full HTML documents.
+## The JavaScript functions are in src/assets/clientside.js.
+## The functions that build charts import altair and plotly.express themselves:
+## they only run when the chart templates are compiled, and these imports
+## take about a second.
+for chart_id in [
+    "country_chart_trend",
+    "disease_chart_trend",
+    "country_chart_snapshot",
+    "disease_chart_snapshot",
+]:
+    app.clientside_callback(
+        ClientsideFunction(namespace="charts", function_name="embed"),
+        Output(chart_id, "className"),
+        Input(f"{chart_id}_spec", "data"),
+        State(chart_id, "id"),
+    )
 
 
-# Define charts
-## Trend Tab
 ###  Line chart by country over the selected year range
-@app.callback(
-    Output("country_chart_trend", "srcDoc"),
-    Input("year_range_widget_trend", "value"),
-    Input("country_widget_trend", "value"),
-    Input("disease_widget_trend", "value"),
-    Input("stat_type_widget_trend", "value"),
-)
-def plot_country(year_range, countries, diseases, stat_type):
+def country_trend_chart(rows, stat_type, first_year, last_year):
+    import altair as alt
+
+    year_range = [first_year, last_year]
     if stat_type == "raw_stats":
         year_chart = (
-            alt.Chart(
-                disease_count_data[
-                    (disease_count_data["year"] >= year_range[0])
-                    & (disease_count_data["year"] <= year_range[1])
-                    & (disease_count_data["country"].isin(countries))
-                    & (disease_count_data["disease"].isin(diseases))
-                ]
-            )
+            alt.Chart(rows)
             .mark_line()
             .encode(
                 x=alt.X(
@@ -761,7 +871,6 @@ def plot_country(year_range, countries, diseases, stat_type):
                 ),
                 y=alt.Y(
                     field="count",
-                    aggregate="sum",
                     type="quantitative",
                     title="Number of deaths",
                 ),
@@ -779,7 +888,6 @@ def plot_country(year_range, countries, diseases, stat_type):
                     ),
                     alt.Tooltip(
                         field="count",
-                        aggregate="sum",
                         type="quantitative",
                         title="Number of deaths",
                     ),
@@ -794,14 +902,7 @@ def plot_country(year_range, countries, diseases, stat_type):
         )
     else:
         year_chart = (
-            alt.Chart(
-                disease_count_data_pc[
-                    (disease_count_data_pc["year"] >= year_range[0])
-                    & (disease_count_data_pc["year"] <= year_range[1])
-                    & (disease_count_data_pc["country"].isin(countries))
-                    & (disease_count_data_pc["disease"].isin(diseases))
-                ]
-            )
+            alt.Chart(rows)
             .mark_line()
             .encode(
                 x=alt.X(
@@ -812,7 +913,6 @@ def plot_country(year_range, countries, diseases, stat_type):
                 ),
                 y=alt.Y(
                     field="count_pkc",
-                    aggregate="sum",
                     type="quantitative",
                     title="Deaths per thousand 0-4-year-olds",
                 ),
@@ -830,7 +930,6 @@ def plot_country(year_range, countries, diseases, stat_type):
                     ),
                     alt.Tooltip(
                         field="count_pkc",
-                        aggregate="sum",
                         type="quantitative",
                         title="Deaths per 1000 0-4-year-olds",
                         format=".2f",
@@ -856,29 +955,30 @@ def plot_country(year_range, countries, diseases, stat_type):
         .configure_axis(labelFontSize=15, titleFontSize=20)
         .configure_legend(orient="right", labelFontSize=15, titleFontSize=20)
         .interactive()
-        .to_html()
     )
 
 
-### Line chart by disease
-@app.callback(
-    Output("disease_chart_trend", "srcDoc"),
-    Input("year_range_widget_trend", "value"),
-    Input("country_widget_trend", "value"),
-    Input("disease_widget_trend", "value"),
-    Input("stat_type_widget_trend", "value"),
+@server_callback(
+    Output("country_chart_trend_spec", "data"),
+    Input("trend_query", "data"),
 )
-def plot_disease(year_range, countries, diseases, stat_type):
+@chart_cache.memoize("country_chart_trend_spec")
+def plot_country(query):
+    return fill_template(
+        spec_templates[query["stat_type"]]["country_chart_trend"],
+        {"first_year": query["first_year"], "last_year": query["last_year"]},
+        trend_result(**query)["by_country"],
+    )
+
+
+### Line chart by disease
+def disease_trend_chart(rows, stat_type, first_year, last_year):
+    import altair as alt
+
+    year_range = [first_year, last_year]
     if stat_type == "raw_stats":
         year_chart = (
-            alt.Chart(
-                disease_count_data[
-                    (disease_count_data["year"] >= year_range[0])
-                    & (disease_count_data["year"] <= year_range[1])
-                    & (disease_count_data["country"].isin(countries))
-                    & (disease_count_data["disease"].isin(diseases))
-                ]
-            )
+            alt.Chart(rows)
             .mark_line()
             .encode(
                 x=alt.X(
@@ -889,7 +989,6 @@ def plot_disease(year_range, countries, diseases, stat_type):
                 ),
                 y=alt.Y(
                     field="count",
-                    aggregate="sum",
                     type="quantitative",
                     title="Number of deaths",
                 ),
@@ -907,7 +1006,6 @@ def plot_disease(year_range, countries, diseases, stat_type):
                     ),
                     alt.Tooltip(
                         field="count",
-                        aggregate="sum",
                         type="quantitative",
                         title="Number of deaths",
                     ),
@@ -922,14 +1020,7 @@ def plot_disease(year_range, countries, diseases, stat_type):
         )
     else:
         year_chart = (
-            alt.Chart(
-                disease_count_data_pc[
-                    (disease_count_data_pc["year"] >= year_range[0])
-                    & (disease_count_data_pc["year"] <= year_range[1])
-                    & (disease_count_data_pc["country"].isin(countries))
-                    & (disease_count_data_pc["disease"].isin(diseases))
-                ]
-            )
+            alt.Chart(rows)
             .mark_line()
             .encode(
                 x=alt.X(
@@ -940,7 +1031,6 @@ def plot_disease(year_range, countries, diseases, stat_type):
                 ),
                 y=alt.Y(
                     field="count_pkc",
-                    aggregate="sum",
                     type="quantitative",
                     title="Deaths per thousand 0-4-year-olds",
                 ),
@@ -958,7 +1048,6 @@ def plot_disease(year_range, countries, diseases, stat_type):
                     ),
                     alt.Tooltip(
                         field="count_pkc",
-                        aggregate="sum",
                         type="quantitative",
                         title="Deaths per 1000 0-4-year-olds",
                         format=".2f",
@@ -984,37 +1073,30 @@ def plot_disease(year_range, countries, diseases, stat_type):
         .configure_axis(labelFontSize=15, titleFontSize=20)
         .configure_legend(orient="right", labelFontSize=15, titleFontSize=20)
         .interactive()
-        .to_html()
+    )
+
+
+@server_callback(
+    Output("disease_chart_trend_spec", "data"),
+    Input("trend_query", "data"),
+)
+@chart_cache.memoize("disease_chart_trend_spec")
+def plot_disease(query):
+    return fill_template(
+        spec_templates[query["stat_type"]]["disease_chart_trend"],
+        {"first_year": query["first_year"], "last_year": query["last_year"]},
+        trend_result(**query)["by_disease"],
     )
 
 
 ## Snapshot Tab
 ### chart by country
-@app.callback(
-    Output("country_chart_snapshot", "srcDoc"),
-    Input("year_widget_snapshot", "value"),
-    Input("country_widget_snapshot", "value"),
-    Input("disease_widget_snapshot", "value"),
-    Input("stat_type_widget_snapshot", "value"),
-    Input("default_number_widget_snapshot", "value"),
-)
-def plot_country(year, countries, diseases, stat_type, number_default_countries):
-    if not (number_default_countries):
-        number_default_countries = 0
+def country_snapshot_chart(
+    country_count, stat_type, year, number_default_countries, min_count, max_count
+):
+    import altair as alt
 
     if stat_type == "raw_stats":
-        country_count = (
-            disease_count_data[
-                (disease_count_data["year"] == year)
-                & (disease_count_data["country"].isin(countries))
-                & (disease_count_data["disease"].isin(diseases))
-            ]
-            .groupby(by="country")
-            .sum()
-            .reset_index()
-        )
-        min_count = list(country_count["count"].sort_values(ascending=False))[-1]
-        max_count = list(country_count["count"].sort_values(ascending=False))[0]
         country_chart = (
             alt.Chart(country_count)
             .mark_bar()
@@ -1045,11 +1127,6 @@ def plot_country(year, countries, diseases, stat_type, number_default_countries)
                     title="Number of deaths",
                 ),
             )
-            .transform_window(
-                window=[{"op": "rank", "as": "rank"}],
-                sort=[{"field": "count", "order": "descending"}],
-            )
-            .transform_filter("datum.rank <= " + str(number_default_countries))
         ).properties(
             title=[
                 f"{number_default_countries} Countries with Most Children Deaths in {year},",
@@ -1057,28 +1134,8 @@ def plot_country(year, countries, diseases, stat_type, number_default_countries)
             ]
         )
     else:
-        country_count_pc = (
-            disease_count_data_pc[
-                (disease_count_data_pc["year"] == year)
-                & (disease_count_data_pc["country"].isin(countries))
-                & (disease_count_data_pc["disease"].isin(diseases))
-            ]
-            .groupby(by="country")
-            .sum()
-            .reset_index()
-        )
-        min_count_pc = (
-            list(country_count_pc["count_pkc"].sort_values(ascending=False))[-1]
-            if countries
-            else None
-        )
-        max_count_pc = (
-            list(country_count_pc["count_pkc"].sort_values(ascending=False))[0]
-            if countries
-            else None
-        )
         country_chart = (
-            alt.Chart(country_count_pc)
+            alt.Chart(country_count)
             .mark_bar()
             .encode(
                 x=alt.X(
@@ -1099,9 +1156,7 @@ def plot_country(year, countries, diseases, stat_type, number_default_countries)
                     title="Count per thousand",
                     sort="-x",
                     legend=None,
-                    scale=alt.Scale(
-                        scheme="plasma", domain=[min_count_pc, max_count_pc]
-                    ),
+                    scale=alt.Scale(scheme="plasma", domain=[min_count, max_count]),
                 ),
                 tooltip=alt.Tooltip(
                     field="count_pkc",
@@ -1110,11 +1165,6 @@ def plot_country(year, countries, diseases, stat_type, number_default_countries)
                     format=".2f",
                 ),
             )
-            .transform_window(
-                window=[{"op": "rank", "as": "rank"}],
-                sort=[{"field": "count_pkc", "order": "descending"}],
-            )
-            .transform_filter("datum.rank <= " + str(number_default_countries))
             .properties(
                 title=[
                     f"{number_default_countries} Countries with Most Deaths Per 1000 Children in {year},",
@@ -1127,30 +1177,45 @@ def plot_country(year, countries, diseases, stat_type, number_default_countries)
         .configure_title(fontSize=15)
         .configure_axis(labelFontSize=12, titleFontSize=15)
         .interactive()
-        .to_html()
     )
 
 
-### Chart by disease
-@app.callback(
-    Output("disease_chart_snapshot", "srcDoc"),
-    Input("year_widget_snapshot", "value"),
-    Input("country_widget_snapshot", "value"),
-    Input("disease_widget_snapshot", "value"),
-    Input("stat_type_widget_snapshot", "value"),
+@server_callback(
+    Output("country_chart_snapshot_spec", "data"),
+    Input("snapshot_query", "data"),
+    Input("default_number_widget_snapshot", "value"),
+)
+@chart_cache.memoize(
+    "country_chart_snapshot_spec", number_default_countries=cache.as_count
 )
-def plot_disease(year, countries, diseases, stat_type):
+def plot_country(query, number_default_countries):
+    if not (number_default_countries):
+        number_default_countries = 0
+
+    ## Only the top countries are sent, but the color domain spans every
+    ## selected country, so that the colors match the map
+    country_count = snapshot_result(**query)["by_country"]
+    column = dataset.value_column(query["stat_type"] != "raw_stats")
+    counts = country_count[column]
+    min_count, max_count = (counts.min(), counts.max()) if len(counts) else (None, None)
+
+    return fill_template(
+        spec_templates[query["stat_type"]]["country_chart_snapshot"],
+        {
+            "year": query["year"],
+            "number": number_default_countries,
+            "min_count": min_count,
+            "max_count": max_count,
+        },
+        dataset.top_rows(country_count, column, number_default_countries),
+    )
+
+
+### Chart by disease
+def disease_snapshot_chart(disease_count, stat_type, year):
+    import altair as alt
+
     if stat_type == "raw_stats":
-        disease_count = (
-            disease_count_data[
-                (disease_count_data["year"] == year)
-                & (disease_count_data["country"].isin(countries))
-                & (disease_count_data["disease"].isin(diseases))
-            ]
-            .groupby(by="disease")
-            .sum()
-            .reset_index()
-        )
 
         disease_chart = (
             alt.Chart(disease_count)
@@ -1186,19 +1251,8 @@ def plot_disease(year, countries, diseases, stat_type):
             )
         )
     else:
-        disease_count_pc = (
-            disease_count_data_pc[
-                (disease_count_data["year"] == year)
-                & (disease_count_data["country"].isin(countries))
-                & (disease_count_data["disease"].isin(diseases))
-            ]
-            .groupby(by="disease")
-            .sum()
-            .reset_index()
-        )
-
         disease_chart = (
-            alt.Chart(disease_count_pc)
+            alt.Chart(disease_count)
             .mark_bar()
             .encode(
                 x=alt.X(
@@ -1238,31 +1292,28 @@ def plot_disease(year, countries, diseases, stat_type):
         .configure_title(fontSize=15)
         .configure_axis(labelFontSize=12, titleFontSize=15)
         .interactive()
-        .to_html()
     )
 
 
-### Map
-@app.callback(
-    Output("map_snapshot", "figure"),
-    Input("year_widget_snapshot", "value"),
-    Input("country_widget_snapshot", "value"),
-    Input("disease_widget_snapshot", "value"),
-    Input("stat_type_widget_snapshot", "value"),
+@server_callback(
+    Output("disease_chart_snapshot_spec", "data"),
+    Input("snapshot_query", "data"),
 )
-def display_choropleth(year, countries, diseases, stat_type):
+@chart_cache.memoize("disease_chart_snapshot_spec")
+def plot_disease(query):
+    return fill_template(
+        spec_templates[query["stat_type"]]["disease_chart_snapshot"],
+        {"year": query["year"]},
+        snapshot_result(**query)["by_disease"],
+    )
+
+
+### Map
+def choropleth_figure(country_count, stat_type):
+    import plotly.express as px
+
     if stat_type == "raw_stats":
-        df = (
-            disease_count_map_data[
-                (disease_count_data["year"] == year)
-                & (disease_count_data["country"].isin(countries))
-                & (disease_count_data["disease"].isin(diseases))
-            ]
-            .groupby(["country", "iso_alpha"])
-            .agg(total_deaths=pd.NamedAgg(column="count", aggfunc="sum"))
-            .reset_index()
-        )
-        df = df.rename(columns={"total_deaths": "Total deaths"})
+        df = country_count.rename(columns={"count": "Total deaths"})
         fig = px.choropleth(
             df,
             locations="iso_alpha",
@@ -1272,7 +1323,7 @@ def display_choropleth(year, countries, diseases, stat_type):
             color_continuous_scale=px.colors.sequential.Plasma,
         )
         fig.update_layout(
-            geo_scope="africa",
+            geo_scope=geo_scope,
             margin=dict(l=0, r=0, b=0, t=0),
             coloraxis_colorbar=dict(
                 title="Total deaths",
@@ -1283,17 +1334,9 @@ def display_choropleth(year, countries, diseases, stat_type):
             ),
         )
     else:
-        df_pc = (
-            disease_count_map_data_pc[
-                (disease_count_data["year"] == year)
-                & (disease_count_data["country"].isin(countries))
-                & (disease_count_data["disease"].isin(diseases))
-            ]
-            .groupby(["country", "iso_alpha"])
-            .agg(deaths_pkc=pd.NamedAgg(column="count_pkc", aggfunc="sum"))
-            .reset_index()
+        df_pc = country_count.rename(
+            columns={"count_pkc": "Deaths per 1000 0-4 year-olds"}
         )
-        df_pc = df_pc.rename(columns={"deaths_pkc": "Deaths per 1000 0-4 year-olds"})
         fig = px.choropleth(
             df_pc,
             locations="iso_alpha",
@@ -1303,7 +1346,7 @@ def display_choropleth(year, countries, diseases, stat_type):
             color_continuous_scale=px.colors.sequential.Plasma,
         )
         fig.update_layout(
-            geo_scope="africa",
+            geo_scope=geo_scope,
             margin=dict(l=0, r=0, b=0, t=0),
             coloraxis_colorbar=dict(
                 title="Deaths per 1,000<br>0-4-year-olds",
@@ -1316,6 +1359,284 @@ def display_choropleth(year, countries, diseases, stat_type):
     return fig
 
 
+def choropleth_data(country_count, stat_type):
+    """The arrays of the map trace that change with the selection."""
+    column = dataset.value_column(stat_type != "raw_stats")
+    return {
+        "stat_type": stat_type,
+        "hovertext": country_count["country"].tolist(),
+        "locations": country_count["iso_alpha"].tolist(),
+        "z": country_count[column].tolist(),
+        "customdata": country_count[["iso_alpha", column]].values.tolist(),
+    }
+
+
+def make_map_templates():
+    """Build the map of each statistic once, from one country whose data the
+    browser replaces; px.choropleth adds no trace for an empty frame."""
+    templates = {}
+    for stat_type in ["raw_stats", "pc_k"]:
+        country_count = dataset.totals_by_country(
+            dataset.cube_years[0],
+            dataset.cube_countries[:1],
+            dataset.cube_diseases,
+            stat_type != "raw_stats",
+        )
+        templates[stat_type] = {
+            "map_snapshot": choropleth_figure(
+                dataset.with_country_attributes(country_count, ["iso_alpha"]),
+                stat_type,
+            ).to_plotly_json()
+        }
+    return templates
+
+
+## The layout, colorbar and geo settings of the map are sent once with the
+## page, in chart_templates; each selection only sends the arrays of the
+## trace, which the browser puts into a copy of the template
+@server_callback(
+    Output("map_snapshot_data", "data"),
+    Input("snapshot_query", "data"),
+)
+@chart_cache.memoize("map_snapshot_data")
+def display_choropleth(query):
+    return choropleth_data(
+        dataset.with_country_attributes(
+            snapshot_result(**query)["by_country"], ["iso_alpha"]
+        ),
+        query["stat_type"],
+    )
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace="charts", function_name="mapFigure"),
+    Output("map_snapshot", "figure"),
+    Input("map_snapshot_data", "data"),
+    State("chart_templates", "data"),
+)
+
+
+# Chart templates
+## Each Altair chart is built once per statistic from an empty selection, with
+## placeholders such as {year}. The chart callbacks only fill in the values and
+## the data, here or in the browser (fillTemplate in src/assets/clientside.js).
+def make_chart_templates():
+    templates = {}
+    for stat_type in ["raw_stats", "pc_k"]:
+        per_capita = stat_type != "raw_stats"
+        country_rows = dataset.trend_by_country(0, -1, [], [], per_capita)
+        disease_rows = dataset.trend_by_disease(0, -1, [], [], per_capita)
+        country_count = dataset.totals_by_country(0, [], [], per_capita)
+        disease_count = dataset.totals_by_disease(0, [], [], per_capita)
+
+        with warnings.catch_warnings():
+            ### Altair warns that it treats the empty label columns as nominal
+            warnings.simplefilter("ignore", UserWarning)
+            templates[stat_type] = {
+                "country_chart_trend": country_trend_chart(
+                    country_rows, stat_type, "{first_year}", "{last_year}"
+                ).to_dict(),
+                "disease_chart_trend": disease_trend_chart(
+                    disease_rows, stat_type, "{first_year}", "{last_year}"
+                ).to_dict(),
+                "country_chart_snapshot": country_snapshot_chart(
+                    country_count,
+                    stat_type,
+                    "{year}",
+                    "{number}",
+                    "{min_count}",
+                    "{max_count}",
+                ).to_dict(),
+                "disease_chart_snapshot": disease_snapshot_chart(
+                    disease_count, stat_type, "{year}"
+                ).to_dict(),
+            }
+    return templates
+
+
+def fill_template(template, values, rows):
+    """Replace "{name}" placeholders: whole strings become JSON values, e.g. a
+    color domain, and placeholders within strings become text, e.g. titles."""
+    text = re.sub(
+        r'"\{(\w+)\}"',
+        lambda match: json.dumps(values[match.group(1)]),
+        json.dumps(template),
+    )
+    text = re.sub(r"\{(\w+)\}", lambda match: str(values[match.group(1)]), text)
+    spec = json.loads(text)
+    spec["datasets"][spec["data"]["name"]] = to_records(rows)
+    return spec
+
+
+def to_records(df):
+    """Rows of a query result as JSON values, with None for missing values,
+    like the data Altair puts in a spec."""
+    names = list(df.columns)
+    columns = [
+        [None if value != value else value for value in df[name].tolist()]
+        for name in names
+    ]
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+## Compiled templates are saved to CHART_TEMPLATES_PATH, so that later starts
+## skip compiling them and importing altair and plotly.express. Deployments
+## write the file when the app is built, with `python -m src.compile_templates`
+## (bin/post_compile on Heroku), as a fresh dyno or container has no file from
+## an earlier start. They are
+## compiled again when the app or query code, the data, the served regions or
+## the library versions change.
+TEMPLATES_PATH = os.environ.get("CHART_TEMPLATES_PATH", "data/chart_templates.json")
+templates_version = cache.fingerprint(
+    [__file__, dataset.__file__, "data/manifest.json"],
+    dataset.regions + [version("altair"), version("plotly")],
+)
+
+
+def compile_templates():
+    import altair as alt
+
+    templates = {
+        "version": templates_version,
+        "vega_versions": {
+            "vega": alt.VEGA_VERSION,
+            "vega-lite": alt.VEGALITE_VERSION,
+            "vega-embed": alt.VEGAEMBED_VERSION,
+        },
+        "charts": make_chart_templates(),
+        "maps": make_map_templates(),
+    }
+    ## As read back from the file
+    return json.loads(json.dumps(templates, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def load_templates(path=TEMPLATES_PATH):
+    try:
+        with open(path) as f:
+            templates = json.load(f)
+        if templates["version"] == templates_version:
+            return templates
+    except (OSError, ValueError, KeyError):
+        pass
+
+    ## Written to a temporary file first, so that workers starting at the same
+    ## time never read a partial file
+    templates = compile_templates()
+    try:
+        with open(f"{path}.{os.getpid()}", "w") as f:
+            json.dump(templates, f)
+        os.replace(f"{path}.{os.getpid()}", path)
+    except OSError as error:
+        print(f"Could not save the chart templates to {path}: {error}")
+    return templates
+
+
+compiled_templates = load_templates()
+spec_templates = compiled_templates["charts"]
+chart_templates.data = compiled_templates["maps"]
+app.config.external_scripts = [
+    f"https://cdn.jsdelivr.net/npm/{name}@{vega_version}"
+    for name, vega_version in compiled_templates["vega_versions"].items()
+]
+
+
+# Client-side filtering
+if clientside_filtering:
+    clientside_dataset.data = dataset.client_data()
+    for stat_type, templates in spec_templates.items():
+        chart_templates.data[stat_type].update(templates)
+
+    app.clientside_callback(
+        ClientsideFunction(namespace="charts", function_name="queryTrend"),
+        Output("trend_query", "data"),
+        Input("year_range_widget_trend", "value"),
+        Input("country_widget_trend", "value"),
+        Input("disease_widget_trend", "value"),
+        Input("stat_type_widget_trend", "value"),
+        State("clientside_dataset", "data"),
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace="charts", function_name="querySnapshot"),
+        Output("snapshot_query", "data"),
+        Input("year_widget_snapshot", "value"),
+        Input("country_widget_snapshot", "value"),
+        Input("disease_widget_snapshot", "value"),
+        Input("stat_type_widget_snapshot", "value"),
+        State("clientside_dataset", "data"),
+    )
+    for chart_id in [
+        "country_chart_trend",
+        "disease_chart_trend",
+        "disease_chart_snapshot",
+    ]:
+        query_id = "trend_query" if chart_id.endswith("trend") else "snapshot_query"
+        app.clientside_callback(
+            ClientsideFunction(namespace="charts", function_name="fillChart"),
+            Output(f"{chart_id}_spec", "data"),
+            Input(query_id, "data"),
+            State("chart_templates", "data"),
+            State(chart_id, "id"),
+        )
+    app.clientside_callback(
+        ClientsideFunction(namespace="charts", function_name="countrySnapshotChart"),
+        Output("country_chart_snapshot_spec", "data"),
+        Input("snapshot_query", "data"),
+        Input("default_number_widget_snapshot", "value"),
+        State("chart_templates", "data"),
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace="charts", function_name="choroplethData"),
+        Output("map_snapshot_data", "data"),
+        Input("snapshot_query", "data"),
+        State("clientside_dataset", "data"),
+    )
+
+
+# Cache warm-up
+## Outputs of the default selections, so that the first users after a deploy
+## or a worker restart do not pay for every chart. Set CHART_CACHE_WARM_UP=1 to
+## warm up at startup, or run `python -m src.warm_cache` to fill the shared
+## cache (CHART_CACHE_PATH) before the workers start.
+def server_output(output):
+    """The function of a server callback, without Dash's request handling."""
+    return app.callback_map[output]["callback"].__wrapped__
+
+
+def warm_up_cache():
+    if clientside_filtering:
+        print("Client-side filtering is enabled, so there is no cache to warm up")
+        return
+
+    start = time.perf_counter()
+    for stat_type in ["raw_stats", "pc_k"]:
+        query = server_output("trend_query.data")(
+            default_year_range, default_country_list, disease_list, stat_type
+        )
+        server_output("country_chart_trend_spec.data")(query)
+        server_output("disease_chart_trend_spec.data")(query)
+
+        for year in range(1990, 2016):
+            query = server_output("snapshot_query.data")(
+                year, default_country_list, disease_list, stat_type
+            )
+            server_output("country_chart_snapshot_spec.data")(
+                query, default_number_countries
+            )
+            server_output("disease_chart_snapshot_spec.data")(query)
+            server_output("map_snapshot_data.data")(query)
+
+    stats = chart_cache.stats()
+    print(
+        f"Warmed up the chart cache in {time.perf_counter() - start:.1f} s: "
+        f"{stats['size']}/{stats['maxsize']} outputs, "
+        f"{chart_cache.nbytes() / 1e6:.1f} MB pickled"
+    )
+
+
+if os.environ.get("CHART_CACHE_WARM_UP") == "1":
+    warm_up_cache()
+
+
 # Run server
 if __name__ == "__main__":
-    app.run_server()
\ No newline at end of file
+    app.run_server()
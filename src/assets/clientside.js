@@ -0,0 +1,323 @@
+// Clientside callbacks of src/app.py.
+//
+// The `widgets` functions update the year displays and the select all /
+// deselect all checklists, so that these widgets never wait on the server.
+// `embed` draws the Vega-Lite specs of the Altair charts, and `mapFigure` puts
+// the data of the map into a copy of its template. The other functions are only
+// used in client-side filtering mode (CLIENTSIDE_FILTERING=1), where they
+// mirror the queries of src/dataset.py on the dataset sent with the layout, and
+// fill in the chart templates built by make_chart_templates.
+
+(function () {
+    // Queries
+
+    function asSet(values) {
+        return Array.from(new Set(values || [])).sort();
+    }
+
+    function valueColumn(statType) {
+        return statType === "raw_stats" ? "count" : "count_pkc";
+    }
+
+    // Positions of the selected labels, in the order of the dataset
+    function positions(labels, selected) {
+        var wanted = new Set(selected);
+        var result = [];
+        labels.forEach(function (label, i) {
+            if (wanted.has(label)) {
+                result.push(i);
+            }
+        });
+        return result;
+    }
+
+    // Like dataset.cube_slice: the selected block of the cube and its labels
+    function cubeSlice(data, firstYear, lastYear, countries, diseases, perCapita) {
+        var nYears = data.years.length;
+        var nDiseases = data.diseases.length;
+        var c = positions(data.countries, countries);
+        var d = positions(data.diseases, diseases);
+        var y = [];
+        for (var j = 0; j < nYears; j++) {
+            if (data.years[j] >= firstYear && data.years[j] <= lastYear) {
+                y.push(j);
+            }
+        }
+
+        function value(i, j, k) {
+            var count = data.count[(c[i] * nYears + y[j]) * nDiseases + d[k]];
+            var ncu5 = data.ncu5[c[i] * nYears + y[j]];
+            if (!perCapita || count === null) {
+                return count;
+            }
+            return ncu5 === null ? null : (1000 * count) / ncu5;
+        }
+
+        return {
+            countries: c.map(function (i) { return data.countries[i]; }),
+            years: y.map(function (j) { return data.years[j]; }),
+            diseases: d.map(function (k) { return data.diseases[k]; }),
+            value: value,
+        };
+    }
+
+    // Like dataset.trend_by_country and trend_by_disease: one row per
+    // country or disease and year, ignoring nulls
+    function trendTotals(block, column, by) {
+        var size = block.countries.length * block.years.length * block.diseases.length;
+        if (size === 0) {
+            return [];
+        }
+        var labels = by === "country" ? block.countries : block.diseases;
+        // One pass over the block, into the sum of each label and year
+        var sums = labels.map(function () {
+            return block.years.map(function () { return 0; });
+        });
+        block.countries.forEach(function (_, i) {
+            block.years.forEach(function (_, j) {
+                block.diseases.forEach(function (_, k) {
+                    var value = block.value(i, j, k);
+                    if (value !== null) {
+                        sums[by === "country" ? i : k][j] += value;
+                    }
+                });
+            });
+        });
+        var rows = [];
+        labels.forEach(function (label, n) {
+            block.years.forEach(function (year, j) {
+                var row = { year: year };
+                row[by] = label;
+                row[column] = sums[n][j];
+                rows.push(row);
+            });
+        });
+        return rows;
+    }
+
+    // Like dataset.totals_by_country and totals_by_disease, ignoring nulls
+    function totals(block, column, by) {
+        var size = block.countries.length * block.years.length * block.diseases.length;
+        if (size === 0) {
+            return [];
+        }
+        var labels = by === "country" ? block.countries : block.diseases;
+        var sums = labels.map(function () { return 0; });
+        block.countries.forEach(function (_, i) {
+            block.years.forEach(function (_, j) {
+                block.diseases.forEach(function (_, k) {
+                    var value = block.value(i, j, k);
+                    if (value !== null) {
+                        sums[by === "country" ? i : k] += value;
+                    }
+                });
+            });
+        });
+        return labels.map(function (label, n) {
+            var row = {};
+            row[by] = label;
+            row[column] = sums[n];
+            return row;
+        });
+    }
+
+    // Templates
+
+    // Replace "{name}" placeholders: whole strings become JSON values, e.g. a
+    // color domain, and placeholders within strings become text, e.g. titles.
+    function fillTemplate(template, values, rows) {
+        var text = JSON.stringify(template)
+            .replace(/"\{(\w+)\}"/g, function (_, name) {
+                return JSON.stringify(values[name]);
+            })
+            .replace(/\{(\w+)\}/g, function (_, name) {
+                return String(values[name]);
+            });
+        var spec = JSON.parse(text);
+        spec.datasets[spec.data.name] = rows;
+        return spec;
+    }
+
+    // The vegaEmbed result of each chart, whose view is finalized before the
+    // chart is drawn again, so that its listeners do not pile up
+    var embedded = {};
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        // The year displays and the select all / deselect all checklists,
+        // which only echo or toggle widget values
+        widgets: {
+            yearDisplay: function (year) {
+                return "Selected year: " + year;
+            },
+
+            yearRangeDisplay: function (yearRange) {
+                return "Selected year range: [" + (yearRange || []).join(", ") + "]";
+            },
+
+            selectAll: function (selected, deselected, options, value) {
+                if ((selected || []).indexOf(1) !== -1) {
+                    return options.map(function (option) { return option.value; });
+                } else if ((deselected || []).indexOf(0) !== -1) {
+                    return [];
+                }
+                return value;
+            },
+
+            // Untick "Deselect all" once "Select all" is ticked or a country
+            // is selected
+            updateDeselectAll: function (selectAll, selected, deselectAll) {
+                if ((selectAll || []).indexOf(1) !== -1 || (selected && selected.length)) {
+                    return [];
+                }
+                return deselectAll;
+            },
+
+            // Untick "Select all" once "Deselect all" is ticked or the
+            // selection changes
+            updateSelectAll: function (deselectAll, selected, selectAll) {
+                if ((deselectAll || []).indexOf(0) !== -1 || (selected && selected.length)) {
+                    return [];
+                }
+                return selectAll;
+            },
+        },
+
+        charts: {
+            embed: function (spec, id) {
+                if (spec) {
+                    embedded[id] = Promise.resolve(embedded[id])
+                        .then(function (previous) {
+                            if (previous) {
+                                previous.finalize();
+                            }
+                            return vegaEmbed("#" + id, spec, { mode: "vega-lite" });
+                        })
+                        .catch(function (error) {
+                            console.error("Could not draw chart " + id, error);
+                            return null;
+                        });
+                }
+                return window.dash_clientside.no_update;
+            },
+
+            // Like choropleth_figure, from the arrays of display_choropleth
+            mapFigure: function (data, templates) {
+                if (!data) {
+                    return window.dash_clientside.no_update;
+                }
+                var figure = JSON.parse(
+                    JSON.stringify(templates[data.stat_type].map_snapshot)
+                );
+                var trace = figure.data[0];
+                trace.hovertext = data.hovertext;
+                trace.locations = data.locations;
+                trace.z = data.z;
+                trace.customdata = data.customdata;
+                return figure;
+            },
+
+            queryTrend: function (yearRange, countries, diseases, statType, data) {
+                var query = {
+                    first_year: yearRange[0],
+                    last_year: yearRange[1],
+                    countries: asSet(countries),
+                    diseases: asSet(diseases),
+                    stat_type: statType,
+                };
+                var block = cubeSlice(
+                    data,
+                    query.first_year,
+                    query.last_year,
+                    query.countries,
+                    query.diseases,
+                    statType !== "raw_stats"
+                );
+                query.by_country = trendTotals(block, valueColumn(statType), "country");
+                query.by_disease = trendTotals(block, valueColumn(statType), "disease");
+                return query;
+            },
+
+            querySnapshot: function (year, countries, diseases, statType, data) {
+                var query = {
+                    year: year,
+                    countries: asSet(countries),
+                    diseases: asSet(diseases),
+                    stat_type: statType,
+                };
+                var block = cubeSlice(
+                    data,
+                    year,
+                    year,
+                    query.countries,
+                    query.diseases,
+                    statType !== "raw_stats"
+                );
+                query.by_country = totals(block, valueColumn(statType), "country");
+                query.by_disease = totals(block, valueColumn(statType), "disease");
+                return query;
+            },
+
+            // Trend charts and the snapshot chart by disease
+            fillChart: function (query, templates, id) {
+                var template = templates[query.stat_type][id];
+                if (id === "disease_chart_snapshot") {
+                    return fillTemplate(template, { year: query.year }, query.by_disease);
+                }
+                return fillTemplate(
+                    template,
+                    { first_year: query.first_year, last_year: query.last_year },
+                    id === "country_chart_trend" ? query.by_country : query.by_disease
+                );
+            },
+
+            countrySnapshotChart: function (query, number, templates) {
+                var column = valueColumn(query.stat_type);
+                var counts = query.by_country.map(function (row) { return row[column]; });
+                var empty = counts.length === 0;
+                // Like dataset.top_rows: ties keep the order of the rows,
+                // and missing values come last
+                var top = query.by_country
+                    .map(function (row, index) { return { row: row, index: index }; })
+                    .sort(function (a, b) {
+                        var x = a.row[column];
+                        var y = b.row[column];
+                        if ((x === null) !== (y === null)) {
+                            return x === null ? 1 : -1;
+                        }
+                        return (y - x) || (a.index - b.index);
+                    })
+                    .slice(0, Math.max(number || 0, 0))
+                    .map(function (item) { return item.row; });
+                return fillTemplate(
+                    templates[query.stat_type].country_chart_snapshot,
+                    {
+                        year: query.year,
+                        number: number || 0,
+                        min_count: empty ? null : Math.min.apply(null, counts),
+                        max_count: empty ? null : Math.max.apply(null, counts),
+                    },
+                    top
+                );
+            },
+
+            // Like display_choropleth
+            choroplethData: function (query, data) {
+                var column = valueColumn(query.stat_type);
+                var iso = {};
+                data.countries.forEach(function (country, i) {
+                    iso[country] = data.iso_alpha[i];
+                });
+                var rows = query.by_country;
+                return {
+                    stat_type: query.stat_type,
+                    hovertext: rows.map(function (row) { return row.country; }),
+                    locations: rows.map(function (row) { return iso[row.country]; }),
+                    z: rows.map(function (row) { return row[column]; }),
+                    customdata: rows.map(function (row) {
+                        return [iso[row.country], row[column]];
+                    }),
+                };
+            },
+        },
+    });
+})();
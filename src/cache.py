@@ -0,0 +1,234 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sqlite3
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+# Settings
+## Number of outputs kept in memory by each worker, enough for the warm-up of
+## the default selections in src/app.py
+CACHE_SIZE = int(os.environ.get("CHART_CACHE_SIZE", 256))
+
+## Optional SQLite file shared by all workers on the same machine, e.g.
+## CHART_CACHE_PATH=$HOME/.cache/dashboard/chart_cache.sqlite. The outputs are
+## pickled, so the file must be in a directory that other users cannot write to
+CACHE_PATH = os.environ.get("CHART_CACHE_PATH")
+SHARED_CACHE_SIZE = int(os.environ.get("CHART_SHARED_CACHE_SIZE", 4096))
+
+
+# Key normalization
+def as_set(values):
+    """Normalize a selection whose order and duplicates do not matter."""
+    return tuple(sorted(set(values or [])))
+
+
+def as_count(value):
+    """Normalize an optional number, where a missing value means 0."""
+    return value or 0
+
+
+def as_key(value):
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def fingerprint(paths, extra=()):
+    """Hash files and strings that the cached outputs depend on."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    for value in extra:
+        digest.update(str(value).encode())
+    return digest.hexdigest()[:16]
+
+
+# Shared backend
+def check_private(path):
+    """Refuse a store that other users could write to: loading a pickle from it
+    would run their code in the app. A missing directory is created private."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    for checked in [directory, path]:
+        if not os.path.exists(checked):
+            continue
+        info = os.stat(checked)
+        if info.st_uid != os.getuid() or info.st_mode & stat.S_IWOTH:
+            raise ValueError(
+                f"{checked} is writable by other users; set CHART_CACHE_PATH "
+                "to a file in a private directory"
+            )
+
+
+class SQLiteStore:
+    """Pickled outputs in a SQLite file, keyed by call and data version.
+
+    Each process opens its own connection, so the store survives gunicorn
+    forking workers, and its threads take turns on it. The oldest entries are
+    evicted beyond `maxsize`.
+    """
+
+    def __init__(self, path, version, maxsize=SHARED_CACHE_SIZE):
+        check_private(path)
+        self.path = path
+        self.version = version
+        self.maxsize = maxsize
+        self.pid = None
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.pid != os.getpid():
+            self.connection = sqlite3.connect(
+                self.path, timeout=5, check_same_thread=False
+            )
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS outputs "
+                "(key TEXT PRIMARY KEY, version TEXT, stored REAL, value BLOB)"
+            )
+            self.pid = os.getpid()
+        return self.connection
+
+    def get(self, key):
+        with self.lock:
+            row = (
+                self.connect()
+                .execute(
+                    "SELECT value FROM outputs WHERE key = ? AND version = ?",
+                    (key, self.version),
+                )
+                .fetchone()
+            )
+        return None if row is None else pickle.loads(row[0])
+
+    def set(self, key, value):
+        value = pickle.dumps(value)
+        with self.lock, self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)",
+                (key, self.version, time.time(), value),
+            )
+            connection.execute(
+                "DELETE FROM outputs WHERE key NOT IN "
+                "(SELECT key FROM outputs ORDER BY stored DESC LIMIT ?)",
+                (self.maxsize,),
+            )
+
+
+# Cache
+class CallbackCache:
+    """Bounded LRU cache of callback outputs, keyed on normalized inputs.
+
+    Outputs are looked up in memory first, then in the shared store if there
+    is one. Failures of the shared store are counted and otherwise ignored, so
+    they never break a callback.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, path=CACHE_PATH, version=""):
+        self.maxsize = maxsize
+        self.outputs = OrderedDict()
+        self.lock = threading.Lock()
+        self.store = SQLiteStore(path, version) if path else None
+        self.counts = {"hits": 0, "shared_hits": 0, "misses": 0, "shared_errors": 0}
+
+    def memoize(self, name, **normalizers):
+        """Cache a function's outputs under `name`, which must be unique, e.g.
+        the id of the callback's output; `normalizers` map argument names to
+        functions that normalize them, e.g. countries=as_set."""
+
+        def decorator(func):
+            signature = inspect.signature(func)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                arguments = signature.bind(*args, **kwargs).arguments
+                key = json.dumps(
+                    [
+                        name,
+                        [
+                            normalizers.get(argument, as_key)(value)
+                            for argument, value in arguments.items()
+                        ],
+                    ],
+                    sort_keys=True,
+                )
+                return self.get_or_compute(key, func, args, kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def get_or_compute(self, key, func, args, kwargs):
+        with self.lock:
+            if key in self.outputs:
+                self.outputs.move_to_end(key)
+                self.counts["hits"] += 1
+                return self.outputs[key]
+
+        value = self.shared_get(key)
+        if value is not None:
+            self.count("shared_hits")
+        else:
+            self.count("misses")
+            value = func(*args, **kwargs)
+            self.shared_set(key, value)
+
+        with self.lock:
+            self.outputs[key] = value
+            self.outputs.move_to_end(key)
+            while len(self.outputs) > self.maxsize:
+                self.outputs.popitem(last=False)
+        return value
+
+    def shared_get(self, key):
+        if self.store is None:
+            return None
+        try:
+            return self.store.get(key)
+        ## Besides SQLite errors, a pickle from other library versions can fail
+        ## to load with about any exception
+        except Exception:
+            self.count("shared_errors")
+            return None
+
+    def shared_set(self, key, value):
+        if self.store is None:
+            return
+        try:
+            self.store.set(key, value)
+        except Exception:
+            self.count("shared_errors")
+
+    def stats(self):
+        with self.lock:
+            size = len(self.outputs)
+            counts = dict(self.counts)
+        return dict(
+            counts,
+            size=size,
+            maxsize=self.maxsize,
+            shared=self.store is not None,
+            pid=os.getpid(),
+        )
+
+    def nbytes(self):
+        """Approximate size of the cached outputs, as pickled."""
+        with self.lock:
+            values = list(self.outputs.values())
+        return sum(len(pickle.dumps(value)) for value in values)
+
+    def clear(self):
+        with self.lock:
+            self.outputs.clear()
@@ -0,0 +1,29 @@
+"""Compile the chart templates into CHART_TEMPLATES_PATH.
+
+Run from the root of the repository, when the app is built:
+
+    python -m src.compile_templates
+
+On Heroku, bin/post_compile runs it while the slug is built, so every dyno
+starts with the templates, without importing Altair and Plotly Express. With
+containers, run it in the image build, after installing the requirements.
+"""
+
+import json
+import os
+import sys
+
+if __name__ == "__main__":
+    ## Importing the app compiles and saves the templates if needed; the cache
+    ## is warmed up when the app serves requests, not at build time
+    os.environ.pop("CHART_CACHE_WARM_UP", None)
+    from src import app
+
+    try:
+        with open(app.TEMPLATES_PATH) as f:
+            saved_version = json.load(f)["version"]
+    except (OSError, ValueError, KeyError):
+        saved_version = None
+    if saved_version != app.templates_version:
+        sys.exit(f"The chart templates could not be saved to {app.TEMPLATES_PATH}")
+    print(f"Chart templates {saved_version} saved to {app.TEMPLATES_PATH}")
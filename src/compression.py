@@ -0,0 +1,67 @@
+import os
+
+import flask
+from flask_compress import Compress
+
+# Settings
+## Encodings offered to clients, in order of preference. Browsers only ask for
+## br over HTTPS, so plain HTTP clients still get gzip
+ALGORITHMS = os.environ.get("COMPRESS_ALGORITHMS", "br,gzip").split(",")
+
+## Brotli level 5 makes the layout and callback responses about 8% smaller
+## than gzip level 6, in about the same time; level 11 takes 100 times longer
+BR_LEVEL = int(os.environ.get("COMPRESS_BR_LEVEL", 5))
+GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+
+
+def compress(server):
+    """Compress the responses of a Flask server with brotli or gzip.
+
+    Dash sets up Flask-Compress itself with gzip only, so the app is created
+    with compress=False and this is called instead.
+    """
+    server.config.update(
+        COMPRESS_ALGORITHM=ALGORITHMS,
+        ## Assets are sent as streamed files, which Flask-Compress cannot gzip
+        COMPRESS_ALGORITHM_STREAMING=[a for a in ALGORITHMS if a != "gzip"]
+        + ["deflate"],
+        COMPRESS_BR_LEVEL=BR_LEVEL,
+        COMPRESS_LEVEL=GZIP_LEVEL,
+        ## Conditional requests are answered by add_etags, before compression
+        COMPRESS_EVALUATE_CONDITIONAL_REQUEST=False,
+    )
+    Compress(server)
+
+
+def add_etags(server):
+    """Give each GET or HEAD response a strong ETag, the hash of its
+    uncompressed body, and answer requests whose If-None-Match has it with an
+    empty 304 response.
+
+    Callback requests are POSTs, which a 304 cannot answer and which browsers
+    and proxies do not revalidate, so they are left alone.
+
+    Must be registered after compress(): Flask runs the last registered
+    after_request function first, so the hash is taken before compression.
+    Flask-Compress then adds the encoding to the ETag (e.g. "abc:br"), which
+    clients send back, so that form matches too.
+    """
+
+    @server.after_request
+    def conditional_response(response):
+        if (
+            flask.request.method not in ("GET", "HEAD")
+            or response.status_code != 200
+            or response.is_streamed
+        ):
+            return response
+        response.add_etag()
+        etag, _ = response.get_etag()
+        for tag in [etag] + [
+            f"{etag}:{algorithm}" for algorithm in server.config["COMPRESS_ALGORITHM"]
+        ]:
+            if tag in flask.request.if_none_match:
+                not_modified = flask.Response(status=304)
+                not_modified.set_etag(tag)
+                return not_modified
+        return response
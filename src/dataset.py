@@ -0,0 +1,270 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+DATA_DIR = "data"
+
+
+## Regions served by this deployment, e.g. DATA_REGIONS=Africa,Asia. Only
+## their partitions (data/region=<name>/) are loaded.
+def served_regions(value, data_dir=DATA_DIR):
+    """The regions of a comma-separated list, each of which must have a
+    partition in `data_dir`."""
+    available = sorted(
+        name.split("=", 1)[1]
+        for name in os.listdir(data_dir)
+        if name.startswith("region=")
+    )
+    selected = [region.strip() for region in value.split(",") if region.strip()]
+    unknown = [region for region in selected if region not in available]
+    if unknown or not selected:
+        problem = f"unknown {', '.join(unknown)}" if unknown else "no region"
+        raise ValueError(
+            f"DATA_REGIONS={value!r} has {problem}; "
+            f"choose among {', '.join(available)}"
+        )
+    return selected
+
+
+regions = served_regions(os.environ.get("DATA_REGIONS", "Africa"))
+
+
+# Import data
+def read_table(name, regions=regions, data_dir=DATA_DIR):
+    ## Memory-map the Feather files rather than reading private copies of them
+    tables = [
+        feather.read_table(
+            os.path.join(data_dir, f"region={region}", f"{name}.feather"),
+            memory_map=True,
+        )
+        for region in regions
+    ]
+    return pa.concat_tables(tables).to_pandas(split_blocks=True)
+
+
+## Canonical fact table: one row per country, year and disease
+disease_count_data = read_table("disease_count_data")
+
+## Country dimension table: sub-region and ISO code of each country
+country_data = read_table("country_data")
+
+
+def as_float64(values):
+    """Widen float32 values to the float64 values they were recorded as.
+
+    The pipeline only stores floats as float32 when their shortest decimal form
+    is the recorded value, so this recovers e.g. 3.77 rather than 3.7699999.
+    """
+    if values.dtype == np.float32:
+        return values.astype(str).astype(np.float64)
+    return values.astype(np.float64)
+
+
+# Cube
+## Dense arrays indexed by country, year and disease, with lookup tables from
+## labels to positions. Queries become fancy-index slices plus axis sums.
+cube_countries = list(country_data["country"])
+cube_years = np.arange(
+    int(disease_count_data["year"].min()), int(disease_count_data["year"].max()) + 1
+)
+cube_diseases = list(disease_count_data["disease"].cat.categories)
+
+country_index = {country: i for i, country in enumerate(cube_countries)}
+disease_index = {disease: i for i, disease in enumerate(cube_diseases)}
+
+## Position of every fact table row in the cube
+row_country = pd.Categorical(
+    disease_count_data["country"], categories=cube_countries
+).codes
+row_year = disease_count_data["year"].to_numpy().astype(np.intp) - cube_years[0]
+row_disease = pd.Categorical(
+    disease_count_data["disease"], categories=cube_diseases
+).codes
+
+count_cube = np.full((len(cube_countries), len(cube_years), len(cube_diseases)), np.nan)
+count_cube[row_country, row_year, row_disease] = as_float64(
+    disease_count_data["count"].to_numpy()
+)
+
+ncu5_cube = np.full((len(cube_countries), len(cube_years)), np.nan)
+ncu5_cube[row_country, row_year] = as_float64(disease_count_data["ncu5"].to_numpy())
+
+## Queries only read the cubes. Making them read-only keeps it that way, so
+## gunicorn workers forked from a preloaded app share their pages.
+count_cube.setflags(write=False)
+ncu5_cube.setflags(write=False)
+
+
+def cube_slice(first_year, last_year, countries, diseases, per_capita=False):
+    """Return the (country, year, disease) block for a selection and its labels.
+
+    Unknown countries and diseases are ignored, like `isin` masks would. With
+    `per_capita`, counts are divided by the number of 0-4 year-olds (per 1000).
+    """
+    country_positions = np.array(
+        [country_index[country] for country in countries if country in country_index],
+        dtype=np.intp,
+    )
+    disease_positions = np.array(
+        [disease_index[disease] for disease in diseases if disease in disease_index],
+        dtype=np.intp,
+    )
+    ## Keep the cube's label order, as a groupby over the long table would
+    country_positions = np.unique(country_positions)
+    disease_positions = np.unique(disease_positions)
+    years = slice(
+        max(first_year - cube_years[0], 0), max(last_year - cube_years[0] + 1, 0)
+    )
+
+    values = count_cube[country_positions, years][:, :, disease_positions]
+    if per_capita:
+        values = 1000 * values / ncu5_cube[country_positions, years][:, :, None]
+
+    return (
+        values,
+        [cube_countries[i] for i in country_positions],
+        cube_years[years],
+        [cube_diseases[i] for i in disease_positions],
+    )
+
+
+def with_country_attributes(df, columns):
+    """Add columns of country_data to query results, e.g. ISO codes for the map.
+
+    Rows are gathered by the country positions of the cube, which follow
+    country_data, rather than by joining on the country names.
+    """
+    positions = df["country"].map(country_index).to_numpy()
+    return df.assign(
+        **{
+            column: country_data[column].iloc[positions].set_axis(df.index)
+            for column in columns
+        }
+    )
+
+
+def value_column(per_capita):
+    return "count_pkc" if per_capita else "count"
+
+
+def totals_by_country(year, countries, diseases, per_capita=False):
+    values, country_labels, _, _ = cube_slice(
+        year, year, countries, diseases, per_capita
+    )
+    ## Like a groupby, only return groups that have selected rows
+    if values.size == 0:
+        values, country_labels = values[:0], []
+    return pd.DataFrame(
+        {
+            "country": country_labels,
+            value_column(per_capita): np.nansum(values, axis=(1, 2)),
+        }
+    )
+
+
+def totals_by_disease(year, countries, diseases, per_capita=False):
+    values, _, _, disease_labels = cube_slice(
+        year, year, countries, diseases, per_capita
+    )
+    ## Like a groupby, only return groups that have selected rows
+    if values.size == 0:
+        values, disease_labels = values[:, :, :0], []
+    return pd.DataFrame(
+        {
+            "disease": disease_labels,
+            value_column(per_capita): np.nansum(values, axis=(0, 1)),
+        }
+    )
+
+
+def top_rows(df, column, n):
+    """The `n` rows with the largest values of `column`, largest first.
+
+    Ties are kept in the order of `df`, which is the cube order, as in
+    countrySnapshotChart in src/assets/clientside.js; missing values come last.
+    """
+    values = df[column].to_numpy()
+    n = min(max(n, 0), len(values))
+    top = np.lexsort((np.arange(len(values)), -values))[:n]
+    return df.iloc[top].reset_index(drop=True)
+
+
+def trend_rows(first_year, last_year, countries, diseases, per_capita=False):
+    """Long-form rows (one per country, year and disease) for a year range."""
+    values, country_labels, year_labels, disease_labels = cube_slice(
+        first_year, last_year, countries, diseases, per_capita
+    )
+    shape = values.shape
+    return pd.DataFrame(
+        {
+            "country": np.repeat(
+                np.array(country_labels, dtype=object), shape[1] * shape[2]
+            ),
+            "year": np.tile(np.repeat(year_labels, shape[2]), shape[0]),
+            "disease": np.tile(
+                np.array(disease_labels, dtype=object), shape[0] * shape[1]
+            ),
+            value_column(per_capita): values.ravel(),
+        }
+    )
+
+
+def trend_by_country(first_year, last_year, countries, diseases, per_capita=False):
+    """One row per country and year, summed over the selected diseases."""
+    values, country_labels, year_labels, _ = cube_slice(
+        first_year, last_year, countries, diseases, per_capita
+    )
+    ## Like a groupby, only return groups that have selected rows
+    if values.size == 0:
+        values, country_labels = values[:0], []
+    return pd.DataFrame(
+        {
+            "country": np.repeat(
+                np.array(country_labels, dtype=object), len(year_labels)
+            ),
+            "year": np.tile(year_labels, len(country_labels)),
+            value_column(per_capita): np.nansum(values, axis=2).ravel(),
+        }
+    )
+
+
+def trend_by_disease(first_year, last_year, countries, diseases, per_capita=False):
+    """One row per disease and year, summed over the selected countries."""
+    values, _, year_labels, disease_labels = cube_slice(
+        first_year, last_year, countries, diseases, per_capita
+    )
+    ## Like a groupby, only return groups that have selected rows
+    if values.size == 0:
+        values, disease_labels = values[:, :, :0], []
+    return pd.DataFrame(
+        {
+            "disease": np.repeat(
+                np.array(disease_labels, dtype=object), len(year_labels)
+            ),
+            "year": np.tile(year_labels, len(disease_labels)),
+            value_column(per_capita): np.nansum(values, axis=0).T.ravel(),
+        }
+    )
+
+
+def client_data():
+    """The cube as plain lists, for client-side filtering in the browser.
+
+    `count` is flattened in (country, year, disease) order and `ncu5` in
+    (country, year) order, with null for missing values.
+    """
+
+    def as_list(values):
+        return np.where(np.isnan(values), None, values).ravel().tolist()
+
+    return {
+        "countries": cube_countries,
+        "years": cube_years.tolist(),
+        "diseases": cube_diseases,
+        "iso_alpha": list(country_data["iso_alpha"]),
+        "count": as_list(count_cube),
+        "ncu5": as_list(ncu5_cube),
+    }
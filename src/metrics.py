@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import Counter
+
+import flask
+
+# Settings
+## Upper bounds of the histogram buckets, in seconds and in bytes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+## Dash runs every server callback through this route
+CALLBACK_PATH = "_dash-update-component"
+
+
+class Histogram:
+    """Cumulative counts of observations under each bucket bound."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+def label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class CallbackMetrics:
+    """Latency, response size, call and error counts of each callback, keyed on
+    its output id (e.g. country_chart_trend_spec.data).
+
+    Requests are timed from the Flask hooks of the callback route, so the
+    latency includes serializing and compressing the response, and the size
+    is that of the body sent. Each worker keeps its own
+    counts, like the chart cache.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.size = {}
+        self.calls = Counter()
+        self.errors = Counter()
+
+    def observe(self, output, seconds, nbytes, error):
+        with self.lock:
+            if output not in self.latency:
+                self.latency[output] = Histogram(LATENCY_BUCKETS)
+                self.size[output] = Histogram(SIZE_BUCKETS)
+            self.latency[output].observe(seconds)
+            self.size[output].observe(nbytes)
+            self.calls[output] += 1
+            if error:
+                self.errors[output] += 1
+
+    def instrument(self, server):
+        """Record every callback request handled by a Flask server."""
+
+        @server.before_request
+        def start_timer():
+            if flask.request.path.endswith(CALLBACK_PATH):
+                flask.g.callback_start = time.perf_counter()
+
+        @server.after_request
+        def record(response):
+            start = flask.g.pop("callback_start", None)
+            if start is not None:
+                body = flask.request.get_json(silent=True) or {}
+                self.observe(
+                    body.get("output", "unknown"),
+                    time.perf_counter() - start,
+                    response.calculate_content_length() or 0,
+                    response.status_code >= 500,
+                )
+            return response
+
+    def render(self):
+        """The metrics in the Prometheus text format."""
+        lines = []
+
+        def histogram(name, help_text, histograms):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for output, h in sorted(histograms.items()):
+                for bound, count in zip(h.buckets, h.counts):
+                    lines.append(
+                        f'{name}_bucket{{output="{label(output)}",le="{bound}"}} {count}'
+                    )
+                lines.append(
+                    f'{name}_bucket{{output="{label(output)}",le="+Inf"}} {h.count}'
+                )
+                lines.append(f'{name}_sum{{output="{label(output)}"}} {h.sum}')
+                lines.append(f'{name}_count{{output="{label(output)}"}} {h.count}')
+
+        def counter(name, help_text, counts):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for output, count in sorted(counts.items()):
+                lines.append(f'{name}{{output="{label(output)}"}} {count}')
+
+        with self.lock:
+            histogram(
+                "dash_callback_duration_seconds",
+                "Time to handle a callback request.",
+                self.latency,
+            )
+            histogram(
+                "dash_callback_response_bytes",
+                "Size of a callback response body.",
+                self.size,
+            )
+            counter("dash_callback_calls_total", "Callback requests.", self.calls)
+            counter(
+                "dash_callback_errors_total",
+                "Callback requests that failed with a server error.",
+                {output: self.errors[output] for output in self.calls},
+            )
+        return "\n".join(lines) + "\n"
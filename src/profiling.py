@@ -0,0 +1,147 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+import flask
+
+from src.metrics import CALLBACK_PATH
+
+# Settings
+## Directory for the profiles. Profiling is off, and adds nothing to requests,
+## unless it is set, e.g. CALLBACK_PROFILE_DIR=/tmp/profiles
+PROFILE_DIR = os.environ.get("CALLBACK_PROFILE_DIR")
+
+## Profile the next CALLBACK_PROFILE_COUNT calls of one callback, given by its
+## output id, e.g. CALLBACK_PROFILE=country_chart_trend_spec.data
+PROFILE_OUTPUT = os.environ.get("CALLBACK_PROFILE")
+PROFILE_COUNT = int(os.environ.get("CALLBACK_PROFILE_COUNT", 10))
+
+## Any callback request with this header is profiled too, e.g. a request
+## copied from the browser's developer tools and replayed with curl. Any client
+## can send it, so each worker writes at most CALLBACK_PROFILE_HEADER_COUNT of
+## these profiles
+PROFILE_HEADER = "X-Profile-Callback"
+PROFILE_HEADER_COUNT = int(os.environ.get("CALLBACK_PROFILE_HEADER_COUNT", 100))
+
+
+def frame_name(code):
+    path = code.co_filename
+    for prefix in ["site-packages" + os.sep, os.getcwd() + os.sep]:
+        if prefix in path:
+            path = path.split(prefix, 1)[1]
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+class StackProfiler:
+    """Time spent in each call stack of the current thread, in microseconds.
+
+    Every call and return is recorded with sys.setprofile, so each stack gets
+    the time spent in its innermost function, not in the functions it calls.
+    """
+
+    def __init__(self):
+        self.stacks = Counter()
+        self.frames = []
+
+    def profile(self, frame, event, arg):
+        now = time.perf_counter()
+        if event == "call":
+            self.frames.append([frame_name(frame.f_code), now, 0])
+        elif event == "c_call":
+            name = getattr(arg, "__qualname__", getattr(arg, "__name__", "?"))
+            module = getattr(arg, "__module__", None) or "builtins"
+            self.frames.append([f"{module}.{name}", now, 0])
+        elif self.frames and event in ("return", "c_return", "c_exception"):
+            self.pop(now)
+
+    def pop(self, now):
+        stack = ";".join(name.replace(";", ",") for name, _, _ in self.frames)
+        _, start, children = self.frames.pop()
+        self.stacks[stack] += round(1e6 * (now - start - children))
+        if self.frames:
+            self.frames[-1][2] += now - start
+
+    def start(self):
+        sys.setprofile(self.profile)
+
+    def stop(self):
+        sys.setprofile(None)
+        now = time.perf_counter()
+        while self.frames:
+            self.pop(now)
+
+    def collapsed(self):
+        """The stacks in the collapsed format of flamegraph.pl and speedscope."""
+        return "".join(
+            f"{stack} {microseconds}\n"
+            for stack, microseconds in sorted(self.stacks.items())
+            if microseconds > 0
+        )
+
+
+class CallbackProfiler:
+    """Profile callback requests and write one collapsed-stack file per call,
+    named after the callback's output id, to `directory`."""
+
+    def __init__(
+        self,
+        directory,
+        output=None,
+        count=PROFILE_COUNT,
+        header_count=PROFILE_HEADER_COUNT,
+    ):
+        self.directory = os.path.realpath(directory)
+        self.output = output
+        self.remaining = count if output else 0
+        self.header_remaining = header_count
+        self.lock = threading.Lock()
+
+    def wanted(self, output):
+        with self.lock:
+            if output == self.output and self.remaining > 0:
+                self.remaining -= 1
+                return True
+            if PROFILE_HEADER in flask.request.headers and self.header_remaining > 0:
+                self.header_remaining -= 1
+                return True
+        return False
+
+    def profile_path(self, output):
+        """The file of a new profile of `output`, which comes from the request,
+        so it is reduced to a file name that stays in the directory and is not
+        hidden."""
+        name = re.sub(r"[^\w.-]", "_", str(output)).lstrip(".") or "unknown"
+        path = os.path.realpath(
+            os.path.join(
+                self.directory,
+                f"{name}-{time.strftime('%Y%m%dT%H%M%S')}"
+                f"-{os.getpid()}-{time.perf_counter_ns()}.collapsed",
+            )
+        )
+        if os.path.dirname(path) != self.directory:
+            raise ValueError(f"profile path {path} is outside {self.directory}")
+        return path
+
+    def instrument(self, server):
+        os.makedirs(self.directory, exist_ok=True)
+
+        @server.before_request
+        def start_profiler():
+            if flask.request.path.endswith(CALLBACK_PATH):
+                output = (flask.request.get_json(silent=True) or {}).get("output")
+                if self.wanted(output):
+                    flask.g.profiler = StackProfiler()
+                    flask.g.profiled_output = output
+                    flask.g.profiler.start()
+
+        @server.after_request
+        def write_profile(response):
+            profiler = flask.g.pop("profiler", None)
+            if profiler is not None:
+                profiler.stop()
+                with open(self.profile_path(flask.g.profiled_output), "w") as f:
+                    f.write(profiler.collapsed())
+            return response
@@ -0,0 +1,26 @@
+"""Precompute the outputs of the default selections into the chart cache.
+
+Run from the root of the repository, with the same settings as the app:
+
+    CHART_CACHE_PATH=$HOME/.cache/dashboard/chart_cache.sqlite python -m src.warm_cache
+
+The outputs are written to the shared cache, where every worker finds them.
+"""
+
+import os
+import sys
+
+from src import cache
+
+if __name__ == "__main__":
+    if not cache.CACHE_PATH:
+        sys.exit(
+            "CHART_CACHE_PATH is not set: without a shared cache, the outputs "
+            "would be lost when this command exits"
+        )
+    ## Importing the app warms up the cache with CHART_CACHE_WARM_UP=1, which
+    ## this command does once, below
+    os.environ.pop("CHART_CACHE_WARM_UP", None)
+    from src import app
+
+    app.warm_up_cache()